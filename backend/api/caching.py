@@ -0,0 +1,113 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import DataVersion, Tag
+
+RECIPE_CACHE_KEY = 'recipe:{}:v{}:{}:{}:{}'
+TAGS_VERSION = 'tags'
+INGREDIENTS_VERSION = 'ingredients'
+RECIPES_VERSION = 'recipes'
+AUTHORS_VERSION = 'authors'
+USER_VERSION = 'user:{}'
+TAG_SLUGS_CACHE_KEY = 'tag-slugs:{}'
+
+
+def get_recipe_cache_key(recipe, catalog_versions):
+    '''Key of the viewer independent payload of the recipe, it changes
+    with every saved edit of the recipe and with any change of tags,
+    ingredients and author profiles rendered into the payload'''
+    return RECIPE_CACHE_KEY.format(
+        recipe.id, recipe.version, *catalog_versions
+    )
+
+
+def get_recipe_payloads(recipes, render, prefetch=None):
+    '''Returns {recipe id: shared payload} fetching the whole batch
+    from the cache at once. Only the missing recipes are passed to
+    prefetch, to load what rendering needs, and rendered'''
+    catalog_versions = get_versions(
+        TAGS_VERSION, INGREDIENTS_VERSION, AUTHORS_VERSION
+    )
+    keys = {
+        get_recipe_cache_key(recipe, catalog_versions): recipe
+        for recipe in recipes
+    }
+    payloads = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in payloads]
+    if missing:
+        if prefetch is not None:
+            prefetch([keys[key] for key in missing])
+        rendered = {key: render(keys[key]) for key in missing}
+        cache.set_many(rendered, settings.RECIPE_CACHE_TIMEOUT)
+        payloads.update(rendered)
+    return {recipe.id: payloads[key] for key, recipe in keys.items()}
+
+
+def get_versions(*names):
+    '''Returns timestamps of the last change of the named data sets
+    with one query. Data sets without a recorded change are recorded
+    as changed now, so validators computed from them only move
+    forward'''
+    versions = dict(
+        DataVersion.objects.filter(name__in=names).values_list(
+            'name', 'changed'
+        )
+    )
+    missing = [name for name in names if name not in versions]
+    if missing:
+        now = time.time()
+        DataVersion.objects.bulk_create(
+            [DataVersion(name=name, changed=now) for name in missing],
+            ignore_conflicts=True
+        )
+        # Another process may have recorded some of them meanwhile
+        versions.update(DataVersion.objects.filter(
+            name__in=missing
+        ).values_list('name', 'changed'))
+    return [versions[name] for name in names]
+
+
+def get_version(name):
+    return get_versions(name)[0]
+
+
+def bump_version(name):
+    now = time.time()
+    if not DataVersion.objects.filter(name=name).update(changed=now):
+        DataVersion.objects.bulk_create(
+            [DataVersion(name=name, changed=now)], ignore_conflicts=True
+        )
+
+
+def get_user_version_name(user):
+    '''Name of the version of per-user flags: favorites, cart and
+    followings, None for anonymous users who have no flags'''
+    if user.is_anonymous:
+        return None
+    return USER_VERSION.format(user.id)
+
+
+def get_user_version(user):
+    name = get_user_version_name(user)
+    return 0 if name is None else get_version(name)
+
+
+def bump_user_version(user_id):
+    bump_version(USER_VERSION.format(user_id))
+
+
+def get_tag_slugs():
+    '''Sorted slugs of all tags, cached until the tags catalog changes'''
+    key = TAG_SLUGS_CACHE_KEY.format(get_version(TAGS_VERSION))
+    slugs = cache.get(key)
+    if slugs is None:
+        slugs = sorted(set(Tag.objects.values_list('slug', flat=True)))
+        cache.set(key, slugs, None)
+    return slugs
+
+
+def make_etag(*parts):
+    return md5(repr(parts).encode()).hexdigest()
@@ -0,0 +1,117 @@
+import binascii
+import re
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.utils.translation import gettext_lazy as _
+from PIL import Image
+from rest_framework import serializers
+
+# Decoded in chunks of this many base64 characters, a multiple of 4
+CHUNK_SIZE = 64 * 1024
+ALLOWED_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'GIF': ('gif', 'image/gif'),
+    'WEBP': ('webp', 'image/webp'),
+}
+WHITESPACE = re.compile(r'\s')
+INVALID_IMAGE = _('Please upload a valid image.')
+INVALID_TYPE = _('Invalid type. This is not an base64 string: {}')
+UNSUPPORTED_FORMAT = _('Image format is not supported, use JPEG, PNG, '
+                       'GIF or WebP.')
+IMAGE_TOO_LARGE = _('Image must not be larger than {} bytes.')
+TOO_MANY_PIXELS = _('Image must not have more than {} pixels.')
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    '''Accepts an image as base64 string, optionally with a data URI
+    header. The string is decoded chunk by chunk into a temporary file,
+    so the decoded image is never held in memory. Size is checked
+    before decoding and format and dimensions right after the first
+    chunk, oversized images are rejected without decoding the rest.'''
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            raise serializers.ValidationError(
+                INVALID_TYPE.format(type(data))
+            )
+        start = data.find(';base64,')
+        start = 0 if start == -1 else start + len(';base64,')
+        if WHITESPACE.search(data, start):
+            data, start = WHITESPACE.sub('', data[start:]), 0
+        encoded_size = len(data) - start
+        if not encoded_size:
+            raise serializers.ValidationError(INVALID_IMAGE)
+        if encoded_size // 4 * 3 > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                IMAGE_TOO_LARGE.format(settings.IMAGE_UPLOAD_MAX_BYTES)
+            )
+        upload = TemporaryUploadedFile(
+            'upload', 'application/octet-stream', 0, None
+        )
+        try:
+            self.decode(data, start, upload)
+            upload.size = upload.tell()
+            extension, content_type = self.check_image(upload)
+        except Exception:
+            upload.close()
+            raise
+        upload.name = '{}.{}'.format(uuid.uuid4(), extension)
+        upload.content_type = content_type
+        upload.seek(0)
+        return upload
+
+    def decode(self, data, start, upload):
+        '''Writes decoded data to the upload, checking the image
+        header as soon as enough chunks are written to read it'''
+        header_checked = False
+        for offset in range(start, len(data), CHUNK_SIZE):
+            try:
+                upload.write(binascii.a2b_base64(
+                    data[offset:offset + CHUNK_SIZE]
+                ))
+            except binascii.Error:
+                raise serializers.ValidationError(INVALID_IMAGE)
+            if not header_checked:
+                header_checked = self.check_header(upload)
+        if not header_checked:
+            raise serializers.ValidationError(INVALID_IMAGE)
+        upload.flush()
+
+    def check_header(self, upload):
+        '''Pillow reads format and dimensions from the header only.
+        Returns False when the data written so far does not contain
+        the whole header yet'''
+        upload.flush()
+        position = upload.tell()
+        upload.seek(0)
+        try:
+            with Image.open(upload) as image:
+                image_format, (width, height) = image.format, image.size
+        except Exception:
+            return False
+        finally:
+            upload.seek(position)
+        if image_format not in ALLOWED_FORMATS:
+            raise serializers.ValidationError(UNSUPPORTED_FORMAT)
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            raise serializers.ValidationError(
+                TOO_MANY_PIXELS.format(settings.IMAGE_UPLOAD_MAX_PIXELS)
+            )
+        return True
+
+    def check_image(self, upload):
+        '''Verifies structure of the complete file without decoding
+        pixel data, returns its extension and content type'''
+        upload.seek(0)
+        try:
+            with Image.open(upload) as image:
+                image.verify()
+                image_format = image.format
+        except Exception:
+            raise serializers.ValidationError(INVALID_IMAGE)
+        if image_format not in ALLOWED_FORMATS:
+            raise serializers.ValidationError(UNSUPPORTED_FORMAT)
+        return ALLOWED_FORMATS[image_format]
@@ -1,13 +1,25 @@
 import django_filters as filters
+from django.conf import settings
+from django.db.models import Case, Exists, IntegerField, OuterRef, When
 from django_filters.rest_framework import FilterSet
 from recipes.models import Ingredient, Recipe
+from recipes.search import search_recipes
+
+from .caching import get_tag_slugs
+from .ingredient_index import ingredient_index
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in get_tag_slugs()]
 
 
 class RecipeFilter(filters.FilterSet):
     "Filters recipes againts tags and author"
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags'
     )
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
@@ -27,11 +39,38 @@ class RecipeFilter(filters.FilterSet):
             queryset = queryset.filter(goods__user=self.request.user)
         return queryset  # noqa
 
+    def filter_tags(self, queryset, name, value):
+        '''Matches recipes having any of the tags with a semi-join,
+        so recipes are not duplicated by the tag join'''
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__slug__in=value
+        )))
+
+    def filter_search(self, queryset, name, value):
+        '''Ranked full-text search over recipe name and description'''
+        return search_recipes(queryset, value)
+
 
 class IngredientNameFilter(filters.FilterSet):
     "Filters ingredients againts name and measurement_unit"
-    name = filters.CharFilter(field_name='name', lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
+
+    def filter_name(self, queryset, name, value):
+        '''Looks names up in the in-memory index, ranking prefix
+        matches before the ones that only contain the value'''
+        try:
+            limit = int(self.request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        limit = max(1, min(limit, settings.INGREDIENT_SEARCH_LIMIT))
+        ids = ingredient_index.search(value, limit)
+        if not ids:
+            return queryset.none()
+        return queryset.filter(id__in=ids).order_by(Case(
+            *[When(id=pk, then=rank) for rank, pk in enumerate(ids)],
+            output_field=IntegerField()
+        ))
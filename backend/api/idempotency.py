@@ -0,0 +1,88 @@
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+IDEMPOTENCY_CACHE_KEY = 'idempotency:{}:{}'
+IDEMPOTENCY_LOCK_KEY = 'idempotency-lock:{}:{}'
+REQUEST_IN_PROGRESS = _(
+    'A request with this Idempotency-Key is still being processed'
+)
+KEY_REUSED = _(
+    'This Idempotency-Key was already used for a different request'
+)
+
+
+def get_idempotency_keys(request):
+    '''Cache keys of the stored response and of the processing lock,
+    client keys are hashed to keep cache keys short and safe'''
+    digest = md5(
+        request.META[IDEMPOTENCY_HEADER].encode()
+    ).hexdigest()
+    return (
+        IDEMPOTENCY_CACHE_KEY.format(request.user.id, digest),
+        IDEMPOTENCY_LOCK_KEY.format(request.user.id, digest),
+    )
+
+
+def get_fingerprint(request):
+    '''Identifies the request a key was used for, a retry must repeat
+    the method, the path and the body'''
+    return (
+        request.method, request.path, md5(request.body).hexdigest()
+    )
+
+
+def replay(stored, fingerprint):
+    stored_fingerprint, status_code, data = stored
+    if stored_fingerprint != fingerprint:
+        return Response(
+            {'errors': KEY_REUSED},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(data, status=status_code)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(handler):
+    '''Decorates a view handler to honor the Idempotency-Key header.
+    The first response of an authenticated user for a key is stored
+    for IDEMPOTENCY_KEY_TIMEOUT seconds and retries with the same key
+    are answered from the cache without running the handler.
+    Only successful responses are stored, a request refused with a client
+    or server error is executed again when retried.'''
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        if (IDEMPOTENCY_HEADER not in request.META
+                or not request.user.is_authenticated):
+            return handler(self, request, *args, **kwargs)
+        cache_key, lock_key = get_idempotency_keys(request)
+        fingerprint = get_fingerprint(request)
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return replay(stored, fingerprint)
+        if not cache.add(
+                lock_key, True, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            return Response(
+                {'errors': REQUEST_IN_PROGRESS},
+                status=status.HTTP_409_CONFLICT
+            )
+        try:
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code < 400:
+                cache.set(
+                    cache_key,
+                    (fingerprint, response.status_code, response.data),
+                    settings.IDEMPOTENCY_KEY_TIMEOUT
+                )
+        finally:
+            cache.delete(lock_key)
+        return response
+    return wrapper
@@ -0,0 +1,222 @@
+import logging
+import os
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageFilter, ImageOps, features
+
+from recipes.models import Recipe
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+# Storage replaces the file name with the hash of the content
+VARIANT_NAME = 'variants/{}.{}'
+IMAGE_FIELDS = ('image', 'image_thumbnail', 'image_display')
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+PLACEHOLDER_URI = 'data:{};base64,{}'
+# EXIF orientations of images stored rotated by 90 degrees
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+EXIF_ORIENTATION = 0x0112
+# Fields cleared when a new image is uploaded,
+# until the worker renders variants of it
+VARIANT_RESET = {
+    'image_thumbnail': '',
+    'image_thumbnail_width': None,
+    'image_thumbnail_height': None,
+    'image_display': '',
+    'image_display_width': None,
+    'image_display_height': None,
+}
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKER_THREADS,
+                thread_name_prefix='image-variants',
+            )
+    return _executor
+
+
+def get_variant_format():
+    '''WebP when Pillow is built with it, JPEG otherwise'''
+    if settings.IMAGE_VARIANT_FORMAT == 'WEBP' and features.check('webp'):
+        return 'WEBP'
+    return 'JPEG'
+
+
+def render_variant(image, size, crop, image_format):
+    '''Returns encoded variant and its dimensions. Cropped variants
+    have exactly the given size, others fit into it and are never
+    upscaled'''
+    if crop:
+        variant = ImageOps.fit(image, size, Image.LANCZOS)
+    else:
+        variant = image.copy()
+        variant.thumbnail(size, Image.LANCZOS)
+    has_alpha = 'A' in variant.getbands()
+    variant = variant.convert(
+        'RGBA' if has_alpha and image_format == 'WEBP' else 'RGB'
+    )
+    buffer = BytesIO()
+    variant.save(
+        buffer, image_format,
+        quality=settings.IMAGE_VARIANT_QUALITY, optimize=True
+    )
+    return buffer.getvalue(), variant.size
+
+
+def describe_image(file):
+    '''Width, height and byte size of the image as shown, taking EXIF
+    orientation into account, and a tiny blurred placeholder encoded
+    as data URI. JPEG images are only partially decoded.'''
+    file.seek(0)
+    with Image.open(file) as image:
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        image.draft('RGB', (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        placeholder = ImageOps.exif_transpose(image).convert('RGB').filter(
+            ImageFilter.GaussianBlur(1)
+        )
+    buffer = BytesIO()
+    image_format = get_variant_format()
+    placeholder.save(buffer, image_format, quality=PLACEHOLDER_QUALITY)
+    file.seek(0)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': file.size,
+        'image_placeholder': PLACEHOLDER_URI.format(
+            Image.MIME[image_format],
+            b64encode(buffer.getvalue()).decode()
+        ),
+    }
+
+
+def make_variants(recipe_id, image_name):
+    '''Renders thumbnail and display variants of the image and records
+    them on the recipe. Nothing is written if the recipe was deleted
+    or got another image in the meantime.'''
+    recipe = Recipe.objects.filter(pk=recipe_id, image=image_name).first()
+    if recipe is None:
+        return
+    with recipe.image.open('rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    image_format = get_variant_format()
+    fields = {}
+    for variant, size, crop in (
+        ('thumbnail', (settings.IMAGE_THUMBNAIL_WIDTH,
+                       settings.IMAGE_THUMBNAIL_HEIGHT), True),
+        ('display', (settings.IMAGE_DISPLAY_SIZE,
+                     settings.IMAGE_DISPLAY_SIZE), False),
+    ):
+        content, (width, height) = render_variant(
+            image, size, crop, image_format
+        )
+        field = 'image_' + variant
+        fields[field] = Recipe._meta.get_field(field).storage.save(
+            VARIANT_NAME.format(variant, image_format.lower()),
+            ContentFile(content)
+        )
+        fields[field + '_width'] = width
+        fields[field + '_height'] = height
+    # Version and modification time are bumped to invalidate
+    # the cached payloads and the validators of conditional GETs
+    if Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+            version=F('version') + 1, updated=timezone.now(), **fields):
+        caching.bump_version(caching.RECIPES_VERSION)
+
+
+def render_safely(recipe_id, image_name):
+    '''Failed rendering leaves the recipe with its original image'''
+    try:
+        make_variants(recipe_id, image_name)
+    except Exception:
+        logger.exception('Unable to render variants of %s', image_name)
+
+
+def run_in_worker(recipe_id, image_name):
+    try:
+        render_safely(recipe_id, image_name)
+    finally:
+        # Worker threads are not managed by the request cycle
+        connection.close()
+
+
+def schedule_variants(recipe):
+    '''Queues rendering of variants of the recipe image once the
+    transaction saving it commits. Rendering happens in a thread
+    pool of IMAGE_WORKER_THREADS threads, or inline when it is 0.'''
+    recipe_id, image_name = recipe.pk, recipe.image.name
+
+    def submit():
+        if settings.IMAGE_WORKER_THREADS:
+            get_executor().submit(run_in_worker, recipe_id, image_name)
+        else:
+            render_safely(recipe_id, image_name)
+
+    transaction.on_commit(submit)
+
+
+def get_image_names(recipe):
+    return [getattr(recipe, field).name for field in IMAGE_FIELDS]
+
+
+def is_same_image(recipe, upload):
+    '''Tells if the upload has the content of the current image,
+    content addressed storage would store it under the same name'''
+    if not recipe.image or not hasattr(
+            recipe.image.storage, 'get_content_name'):
+        return False
+    return recipe.image.storage.get_content_name(
+        recipe.image.field.generate_filename(recipe, upload.name), upload
+    ) == recipe.image.name
+
+
+def release_files(names):
+    '''Deletes files of names no recipe refers to any more. Files
+    saved within MEDIA_RELEASE_GRACE seconds may belong to a not yet
+    committed recipe with the same content and are left to
+    the sweep_media command'''
+    names = {name for name in names if name}
+    if not names:
+        return
+    referenced = set()
+    for field in IMAGE_FIELDS:
+        referenced.update(Recipe.objects.filter(
+            **{field + '__in': names}
+        ).values_list(field, flat=True))
+    threshold = time.time() - settings.MEDIA_RELEASE_GRACE
+    for name in names - referenced:
+        try:
+            modified = os.path.getmtime(default_storage.path(name))
+        except FileNotFoundError:
+            continue
+        if modified <= threshold:
+            default_storage.delete(name)
+
+
+def schedule_release(names):
+    '''Releases files once the transaction dropping
+    the references to them commits'''
+    names = list(names)
+    transaction.on_commit(lambda: release_files(names))
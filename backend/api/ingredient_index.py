@@ -0,0 +1,65 @@
+import threading
+from bisect import bisect_left
+
+from recipes.models import Ingredient
+from . import caching
+
+
+class IngredientIndex:
+    '''Process-local autocomplete index over the ingredient catalog.
+    Names are kept case-folded in a sorted list, so prefix lookups are
+    a binary search instead of an istartswith scan in the database.
+    The index is rebuilt whenever the ingredients catalog version,
+    shared by all processes through the database, changes.'''
+    def __init__(self):
+        # Version, keys and ids are published together with a single
+        # assignment, so readers never mix two generations of them
+        self.index = (None, (), ())
+        self.lock = threading.Lock()
+
+    def build(self, version):
+        entries = sorted(
+            (name.casefold(), pk) for pk, name in
+            Ingredient.objects.order_by().values_list('id', 'name')
+        )
+        return (
+            version,
+            tuple(key for key, _ in entries),
+            tuple(pk for _, pk in entries),
+        )
+
+    def refresh(self):
+        '''Returns (keys, ids) of the current catalog version'''
+        version = caching.get_version(caching.INGREDIENTS_VERSION)
+        index = self.index
+        if version != index[0]:
+            with self.lock:
+                index = self.index
+                if version != index[0]:
+                    index = self.index = self.build(version)
+        return index[1:]
+
+    def search(self, query, limit):
+        '''Returns up to limit ingredient ids whose names start with
+        the query followed by the ones only containing it'''
+        keys, ids = self.refresh()
+        query = query.strip().casefold()
+        found = []
+        position = bisect_left(keys, query)
+        while (
+            position < len(keys) and len(found) < limit
+            and keys[position].startswith(query)
+        ):
+            found.append(ids[position])
+            position += 1
+        if len(found) < limit:
+            prefixed = set(found)
+            for key, pk in zip(keys, ids):
+                if query in key and pk not in prefixed:
+                    found.append(pk)
+                    if len(found) == limit:
+                        break
+        return found
+
+
+ingredient_index = IngredientIndex()
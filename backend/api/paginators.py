@@ -1,4 +1,109 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import (EmptyPage, Page, PageNotAnInteger,
+                                   Paginator)
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+INVALID_CURSOR = _('Invalid cursor')
+CURSOR_SEPARATOR = '|'
+FORWARD, REVERSE = 'n', 'p'
+COUNT_CACHE_KEY = 'pagination-count:{}'
+POSTGRES_ESTIMATE_SQL = (
+    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass'
+)
+
+
+def get_postgres_estimate(queryset):
+    '''Returns planner row estimate of an unfiltered queryset table
+    on PostgreSQL or None when the estimate is not applicable'''
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRES_ESTIMATE_SQL, [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD:
+        return None
+    return int(row[0])
+
+
+def get_approximate_count(queryset):
+    '''Returns (count, is_exact) for a queryset. Totals are cached
+    per SQL signature of the filtered queryset for a short time and
+    large unfiltered tables on PostgreSQL use the planner estimate'''
+    try:
+        signature = str(queryset.query)
+    except EmptyResultSet:
+        return 0, True
+    key = COUNT_CACHE_KEY.format(md5(signature.encode()).hexdigest())
+    count = cache.get(key)
+    if count is not None:
+        return count, False
+    count = get_postgres_estimate(queryset)
+    is_exact = count is None
+    if is_exact:
+        count = queryset.count()
+    cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    return count, is_exact
+
+
+class ApproximateCountPage(Page):
+    '''Page which knows from its own fetch whether more objects follow,
+    so navigation stays correct while the total is only approximate'''
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class ApproximateCountDjangoPaginator(Paginator):
+    '''Django paginator with count served by get_approximate_count.
+    Pages are sliced without relying on the count and the total
+    is corrected whenever a fetched page proves it wrong.'''
+    count_is_exact = True
+
+    @cached_property
+    def count(self):
+        count, self.count_is_exact = get_approximate_count(self.object_list)
+        return count
+
+    def page(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        bottom = (number - 1) * self.per_page
+        object_list = list(
+            self.object_list[bottom:bottom + self.per_page + 1]
+        )
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if not object_list and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        fetched = bottom + len(object_list)
+        if not has_more and (object_list or number == 1):
+            self.count, self.count_is_exact = fetched, True
+        elif has_more and self.count <= fetched:
+            self.count = fetched + 1
+        return ApproximateCountPage(object_list, number, self, has_more)
 
 
 class CustomPageNumberPaginator(PageNumberPagination):
@@ -7,3 +112,119 @@ class CustomPageNumberPaginator(PageNumberPagination):
     client may request.'''
     page_size_query_param = 'limit'
     page_size = 10
+
+
+class ApproximateCountPaginator(CustomPageNumberPaginator):
+    '''CustomPageNumberPaginator serving cached or estimated totals
+    instead of running exact COUNT(*) on every request. The response
+    tells the client whether the count is exact.'''
+    django_paginator_class = ApproximateCountDjangoPaginator
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_is_exact'] = self.page.paginator.count_is_exact
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_exact'] = {
+            'type': 'boolean',
+        }
+        return response_schema
+
+
+class RecipeCursorPaginator(BasePagination):
+    '''Keyset pagination over (pub_date, id) for the recipe feed.
+    Every page is fetched with an indexed range condition instead
+    of OFFSET, so deep pages cost the same as the first one.
+    The response keeps the count/next/previous/results envelope
+    of CustomPageNumberPaginator.'''
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 10
+    ordering = ('-pub_date', '-id')
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, FORWARD
+        try:
+            direction, pub_date, pk = b64decode(
+                encoded.encode('ascii'), altchars=b'-_'
+            ).decode('ascii').split(CURSOR_SEPARATOR)
+            position = (parse_datetime(pub_date), int(pk))
+        except (BinasciiError, UnicodeError, ValueError):
+            raise NotFound(INVALID_CURSOR)
+        if direction not in (FORWARD, REVERSE) or position[0] is None:
+            raise NotFound(INVALID_CURSOR)
+        return position, direction
+
+    def encode_cursor(self, recipe, direction):
+        raw = CURSOR_SEPARATOR.join(
+            (direction, recipe.pub_date.isoformat(), str(recipe.pk))
+        )
+        encoded = b64encode(raw.encode('ascii'), altchars=b'-_')
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded.decode('ascii')
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.count, self.count_is_exact = get_approximate_count(queryset)
+        page_size = self.get_page_size(request)
+        position, direction = self.decode_cursor(request)
+
+        if direction == REVERSE:
+            queryset = queryset.order_by('pub_date', 'id').filter(
+                Q(pub_date__gt=position[0])
+                | Q(pub_date=position[0], id__gt=position[1])
+            )
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            if position is not None:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=position[0])
+                    | Q(pub_date=position[0], id__lt=position[1])
+                )
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if direction == REVERSE:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next = self.previous = None
+        if results and has_next:
+            self.next = self.encode_cursor(results[-1], FORWARD)
+        if has_previous:
+            self.previous = (
+                self.encode_cursor(results[0], REVERSE) if results
+                else remove_query_param(
+                    self.base_url, self.cursor_query_param
+                )
+            )
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('count_is_exact', self.count_is_exact),
+            ('next', self.next),
+            ('previous', self.previous),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return ApproximateCountPaginator().get_paginated_response_schema(
+            schema
+        )
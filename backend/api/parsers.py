@@ -0,0 +1,42 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser
+
+REQUEST_TOO_LARGE = _('Request body must not be larger than {} bytes.')
+
+
+class RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = 'request_too_large'
+
+
+def get_content_length(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+class SizeLimitedJSONParser(JSONParser):
+    '''Refuses JSON bodies larger than DATA_UPLOAD_MAX_MEMORY_SIZE.
+    Django applies the limit to request.body and form data only,
+    DRF parsers read the request stream directly. Bodies declaring
+    a bigger Content-Length are refused before anything is read,
+    others are read no further than the limit.'''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if limit is None:
+            return super().parse(stream, media_type, parser_context)
+        error = RequestTooLarge(REQUEST_TOO_LARGE.format(limit))
+        request = (parser_context or {}).get('request')
+        if request is not None and get_content_length(request) > limit:
+            raise error
+        data = stream.read(limit + 1)
+        if len(data) > limit:
+            raise error
+        return super().parse(BytesIO(data), media_type, parser_context)
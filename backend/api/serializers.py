@@ -1,12 +1,16 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.utils.translation import gettext_lazy as _
 from djoser.serializers import TokenCreateSerializer, UserCreateSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
 from recipes.models import (Cart, Favorite, Following, Ingredient,
                             IngredientRecipe, Recipe, Tag)
 from users.models import User
-from . import service_functions
+from . import caching, images, service_functions
+from .fields import StreamingBase64ImageField
 
 POSITIVE_VALUE_REQUIRED = _('Value of ingredient must be positive')
 UNABLE_TO_SIGN_FOR_YOURSELF = _('Unable to sign up for yourself')
@@ -22,13 +26,16 @@ RECIPE_IS_ALREADY_IN_THE_SHOPPING_CART = _(
 ONLY_AUTHOR_CAN_DELETE_RECIPE = _(
     'Only author can delete the recipe'
 )
-TAG_ID_ALREADY_ASSIGNED = _(
-    'Tag with ID {} was already assigned to this recipe with ID {}'
-)
 NO_INGREDIENT_IN_DATABASE = _(
     "There is no ingredient with ID '{}' in the database"
 )
-ENTRY_DUPLICATION_MESSAGE = "{} with ID '{}' duplicates provided list of IDs"
+NO_TAG_IN_DATABASE = _(
+    "There is no tag with ID '{}' in the database"
+)
+SRCSET_CANDIDATE = '{} {}w'
+ENTRY_DUPLICATION_MESSAGE = _(
+    "{} with ID '{}' duplicates provided list of IDs"
+)
 
 
 class CustomTokenCreateSerializer(TokenCreateSerializer):
@@ -49,18 +56,27 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         )
 
 
-class UserSerializer(serializers.ModelSerializer):
-    '''Nested serializer for RecipeReadSerializer'''
-    is_subscribed = serializers.SerializerMethodField()
-
+class AuthorSerializer(serializers.ModelSerializer):
+    '''Viewer independent part of UserSerializer'''
     class Meta:
         model = User
         fields = (
             'email', 'id', 'username', 'first_name', 'last_name',
-            'is_subscribed'
         )
 
+
+class UserSerializer(AuthorSerializer):
+    '''Nested serializer for RecipeReadSerializer'''
+    is_subscribed = serializers.SerializerMethodField()
+
+    class Meta(AuthorSerializer.Meta):
+        fields = AuthorSerializer.Meta.fields + ('is_subscribed',)
+
     def get_is_subscribed(self, obj):
+        '''Prefers the flag set by RecipeReadSerializer from
+        the annotated queryset of RecipeViewSet'''
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -87,8 +103,55 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class RecipeImageField(serializers.ImageField):
+    '''URL of the image variant fitting the context, the original
+    upload is served until api.images has rendered the variant'''
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return super().to_representation(
+            getattr(recipe, self.variant) or recipe.image
+        )
+
+
+class ImageMetaField(serializers.Field):
+    '''Dimensions, byte size and placeholder of the recipe image
+    with srcset of the sizes available. Built from stored fields
+    only, the files are not touched.'''
+    def __init__(self, **kwargs):
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def get_url(self, file):
+        request = self.context.get('request')
+        url = file.url
+        return request.build_absolute_uri(url) if request else url
+
+    def to_representation(self, recipe):
+        if recipe.image_width is None:
+            return None
+        candidates = {recipe.image_width: recipe.image}
+        if recipe.image_display and recipe.image_display_width:
+            candidates[recipe.image_display_width] = recipe.image_display
+        return OrderedDict((
+            ('width', recipe.image_width),
+            ('height', recipe.image_height),
+            ('size', recipe.image_size),
+            ('placeholder', recipe.image_placeholder),
+            ('srcset', ', '.join(
+                SRCSET_CANDIDATE.format(self.get_url(file), width)
+                for width, file in sorted(candidates.items())
+            )),
+        ))
+
+
 class SimpleRecipeSerializer(serializers.ModelSerializer):
     ''' Nested serializer for SubscribersSerializer'''
+    image = RecipeImageField('image_thumbnail')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -102,7 +165,7 @@ class SubscribersSerializer(serializers.ModelSerializer):
     ''''Nested serializer for FollowingBaseSerializer.
     It also serves ListMyFollowingsViewSet'''
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -112,9 +175,6 @@ class SubscribersSerializer(serializers.ModelSerializer):
             'is_subscribed', 'recipes', 'recipes_count'
         )
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
-
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
@@ -135,37 +195,14 @@ class SubscribersSerializer(serializers.ModelSerializer):
         ).data
 
 
-class SimpleFollowSerializer(serializers.ModelSerializer):
-    '''Nested Serrializer that allows to unfollow user with DELETE
-    through  ManageFollowingsViewSet'''
-    class Meta:
-        model = Following
-        fields = ['user', 'author']
-
-
 class FollowingBaseSerializer(serializers.ModelSerializer):
-    '''Serrializer that allows to follow user with GET through
-    ManageFollowingsViewSet'''
+    '''Serrializer that represents the subscription made with GET
+    through ManageFollowingsViewSet'''
 
     class Meta:
         model = Following
         fields = '__all__'
 
-    def validate(self, attrs):
-        '''Repeats unqique contraint of the Following model'''
-        request = self.context['request']
-        if request.method == 'GET':
-            if request.user == attrs['author']:
-                raise serializers.ValidationError(
-                    UNABLE_TO_SIGN_FOR_YOURSELF
-                )
-            if Following.objects.filter(
-                    user=request.user,
-                    author=attrs['author']
-            ).exists():
-                raise serializers.ValidationError(ALREADY_SUBSCRIBED)
-        return attrs
-
     def to_representation(self, instance):
         return SubscribersSerializer(
             instance.author,
@@ -187,33 +224,97 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit', 'amount']
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
-    '''Serializer serves RecipeViewSet'''
+class RecipeSharedSerializer(serializers.ModelSerializer):
+    '''Viewer independent part of RecipeReadSerializer payload
+    which is cached per recipe version'''
     tags = TagSerializer(many=True)
-    author = UserSerializer()
+    author = AuthorSerializer()
     ingredients = serializers.SerializerMethodField()
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    image = RecipeImageField('image_display')
+    image_meta = ImageMetaField()
 
     class Meta:
         model = Recipe
         fields = [
             'id', 'tags', 'author', 'ingredients',
-            'is_favorited', 'is_in_shopping_cart',
-            'name', 'image', 'text', 'cooking_time'
+            'name', 'image', 'image_meta', 'text', 'cooking_time'
         ]
 
     def get_ingredients(self, obj):
-        queryset = IngredientRecipe.objects.filter(recipe=obj)
+        '''Uses portions loaded by prefetch_recipe_details when available'''
+        queryset = obj.portioned.all()
         return IngredientRecipeSerializer(queryset, many=True).data
 
+
+class RecipeListSerializer(serializers.ListSerializer):
+    '''Fetches cached payloads of the whole page in one cache call,
+    tags and ingredients are loaded only for recipes missing there'''
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        payloads = caching.get_recipe_payloads(
+            recipes, self.child.render_shared,
+            service_functions.prefetch_recipe_details
+        )
+        return [
+            self.child.overlay_user_flags(recipe, payloads[recipe.id])
+            for recipe in recipes
+        ]
+
+
+class RecipeReadSerializer(RecipeSharedSerializer):
+    '''Serializer serves RecipeViewSet. The shared part of the payload
+    comes from the cache and per-user flags are overlaid on top of it'''
+    author = UserSerializer()
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
+
+    class Meta(RecipeSharedSerializer.Meta):
+        fields = [
+            'id', 'tags', 'author', 'ingredients',
+            'is_favorited', 'is_in_shopping_cart',
+            'name', 'image', 'image_meta', 'text', 'cooking_time'
+        ]
+        list_serializer_class = RecipeListSerializer
+
+    def render_shared(self, instance):
+        return RecipeSharedSerializer(instance, context=self.context).data
+
+    def overlay_user_flags(self, instance, shared):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        data = OrderedDict(
+            (field, shared.get(field)) for field in self.Meta.fields
+        )
+        data['author'] = OrderedDict(
+            shared['author'],
+            is_subscribed=UserSerializer(
+                context=self.context
+            ).get_is_subscribed(instance.author)
+        )
+        data['is_favorited'] = self.get_is_favorited(instance)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(instance)
+        return data
+
+    def to_representation(self, instance):
+        payloads = caching.get_recipe_payloads(
+            [instance], self.render_shared,
+            service_functions.prefetch_recipe_details
+        )
+        return self.overlay_user_flags(instance, payloads[instance.id])
+
     def get_is_favorited(self, obj):
+        '''Prefers the flag annotated by RecipeViewSet.get_queryset'''
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return Favorite.objects.filter(user=request.user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        '''Prefers the flag annotated by RecipeViewSet.get_queryset'''
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -223,11 +324,24 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         ).exists()
 
 
+class BatchSerializer(serializers.Serializer):
+    '''Serializer for list of recipe or author IDs passed
+    to batch endpoints'''
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_SIZE_LIMIT,
+    )
+
+
 class ShortRecipeSerializer(serializers.ModelSerializer):
     '''Service cerializer for FavoriteSerializer to_representation method'''
+    image = RecipeImageField('image_thumbnail')
+    image_meta = ImageMetaField()
+
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'image_meta', 'cooking_time']
 
 
 class AddIngredientToRecipeSerializer(serializers.ModelSerializer):
@@ -243,12 +357,9 @@ class AddIngredientToRecipeSerializer(serializers.ModelSerializer):
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     '''Serializer for creating, updating, and deleting recipes'''
-    image = Base64ImageField(max_length=None, use_url=True)
+    image = StreamingBase64ImageField(max_length=None, use_url=True)
     tags = serializers.ListField(
-        child=serializers.SlugRelatedField(
-            slug_field='id',
-            queryset=Tag.objects.all(),
-        ),
+        child=serializers.IntegerField(),
     )
     ingredients = AddIngredientToRecipeSerializer(many=True)
     cooking_time = serializers.IntegerField()
@@ -264,13 +375,21 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         '''Repeats unqique constraint and assures that new recipe
         doesnt duplicate a record'''
         request = self.context['request']
-        if request.method == 'POST' and Recipe.objects.filter(
-                    author=request.user,
-                    name=data['name'],
-                    text=data['text']).exists():
-            raise serializers.ValidationError(
-                        RECIPE_UNIQUE_CONSTRAINT_MESSAGE
+        if request.method in ['POST', 'PUT', 'PATCH']:
+            duplicates = Recipe.objects.filter(
+                author=request.user if self.instance is None
+                else self.instance.author,
+                fingerprint=Recipe.make_fingerprint(
+                    data.get('name', getattr(self.instance, 'name', '')),
+                    data.get('text', getattr(self.instance, 'text', '')),
+                )
             )
+            if self.instance is not None:
+                duplicates = duplicates.exclude(pk=self.instance.pk)
+            if duplicates.exists():
+                raise serializers.ValidationError(
+                    RECIPE_UNIQUE_CONSTRAINT_MESSAGE
+                )
 
         if (
             request.method == 'DELETE' and request.user != data[
@@ -279,40 +398,39 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return data
 
     def validate_tags(self, data):
-        if self.context["request"].method in ['POST', 'PUT']:
-            ids_list = []
-            for tag in data:
-                item_id = tag.id
-                service_functions.list_contains_unique_objects(
-                    ids_list, item_id
-                )
-        if self.context["request"].method == 'PUT':
-            recipe_id = self.instance.id
-            if Recipe.objects.filter(
-                id=recipe_id,
-                tags__id=item_id
-            ).exists():
-                raise serializers.ValidationError(
-                    TAG_ID_ALREADY_ASSIGNED.format(item_id, recipe_id)
-                )
-        return data
+        '''Resolves all tags with one query and reports every
+        duplicated or unknown ID at once'''
+        tags = Tag.objects.in_bulk(set(data))
+        errors = [
+            ENTRY_DUPLICATION_MESSAGE.format(_('Tag'), item_id)
+            for item_id in service_functions.find_duplicates(data)
+        ] + [
+            NO_TAG_IN_DATABASE.format(item_id)
+            for item_id in sorted(set(data) - set(tags))
+        ]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return [tags[item_id] for item_id in data]
 
     def validate_ingredients(self, data):
-        if self.context["request"].method in ['POST', 'PUT']:
-            ids_list = []
-            for element in data:
-                item_id = element['id']
-                service_functions.list_contains_unique_objects(
-                    ids_list, item_id
-                )
-                service_functions.negative_value_constraint(
-                    element['amount'])
-                try:
-                    Ingredient.objects.get(id=item_id)
-                except Ingredient.DoesNotExist:
-                    raise serializers.ValidationError(
-                        NO_INGREDIENT_IN_DATABASE.format(item_id)
-                    )
+        '''Resolves all ingredients with one query, reports every
+        duplicated or unknown ID and non-positive amount at once and
+        keeps resolved objects for create and update'''
+        ids = [element['id'] for element in data]
+        ingredients = Ingredient.objects.in_bulk(set(ids))
+        errors = [
+            ENTRY_DUPLICATION_MESSAGE.format(_('Ingredient'), item_id)
+            for item_id in service_functions.find_duplicates(ids)
+        ] + [
+            NO_INGREDIENT_IN_DATABASE.format(item_id)
+            for item_id in sorted(set(ids) - set(ingredients))
+        ]
+        if any(element['amount'] <= 0 for element in data):
+            errors.append(POSITIVE_VALUE_REQUIRED)
+        if errors:
+            raise serializers.ValidationError(errors)
+        for element in data:
+            element['ingredient'] = ingredients[element['id']]
         return data
 
     def validate_cooking_time(self, data):
@@ -326,26 +444,75 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         of ingredients in one request'''
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
-        service_functions.calculate_ingredients(ingredients, recipe)
+        validated_data.update(images.describe_image(validated_data['image']))
+        try:
+            with transaction.atomic():
+                recipe = Recipe.objects.create(**validated_data)
+                service_functions.sync_tags(tags, recipe)
+                service_functions.calculate_ingredients(ingredients, recipe)
+                service_functions.change_recipes_count(recipe.author_id, 1)
+                images.schedule_variants(recipe)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                RECIPE_UNIQUE_CONSTRAINT_MESSAGE
+            )
         return recipe
 
     def update(self, instance, validated_data):
-        '''Method allows to update recipe amount
-        of ingredients in one request'''
-        if 'ingredients' in self.validated_data:
-            ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            service_functions.calculate_ingredients(ingredients, instance)
-        tags = validated_data.pop('tags')
-        instance.tags.set(tags)
-        return super().update(instance, validated_data)
+        '''Method applies only the difference between stored and
+        submitted ingredients and tags. The recipe is saved, and its
+        version bumped, only when something actually changed;
+        self.changes tells what it was.'''
+        try:
+            with transaction.atomic():
+                instance = self.apply_changes(instance, validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                RECIPE_UNIQUE_CONSTRAINT_MESSAGE
+            )
+        return instance
+
+    def apply_changes(self, instance, validated_data):
+        image_changed = 'image' in validated_data
+        if image_changed and images.is_same_image(
+                instance, validated_data['image']):
+            # Clients re-send the image on every edit
+            del validated_data['image']
+            image_changed = False
+        self.changes = {
+            'ingredients': 'ingredients' in validated_data
+            and service_functions.sync_ingredients(
+                validated_data.pop('ingredients'), instance
+            ),
+            'tags': 'tags' in validated_data
+            and service_functions.sync_tags(
+                validated_data.pop('tags'), instance
+            ),
+            'fields': any(
+                getattr(instance, field) != value
+                for field, value in validated_data.items()
+            ),
+        }
+        if image_changed:
+            images.schedule_release(images.get_image_names(instance))
+            validated_data.update(images.VARIANT_RESET)
+            validated_data.update(
+                images.describe_image(validated_data['image'])
+            )
+        if any(self.changes.values()):
+            instance = super().update(instance, validated_data)
+        if image_changed:
+            images.schedule_variants(instance)
+        return instance
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = service_functions.prepare_recipes(
+            Recipe.objects.filter(pk=instance.pk), request.user
+        ).get()
         return RecipeReadSerializer(
             instance,
-            context={'request': self.context.get('request')}
+            context={'request': request}
         ).data
 
 
@@ -356,17 +523,6 @@ class ManageFavoriteSerializer(serializers.ModelSerializer):
         model = Favorite
         fields = '__all__'
 
-    def validate(self, data):
-        request = self.context['request']
-        if (request.method == 'GET'
-            and Favorite.objects.filter(
-                user=request.user,
-                recipe__id=data['recipe'].id).exists()):
-            raise serializers.ValidationError(
-                RECIPE_IS_ALREADY_IN_FAVORITES
-            )
-        return data
-
     def to_representation(self, instance):
         return ShortRecipeSerializer(
             instance.recipe,
@@ -381,17 +537,6 @@ class ManageCartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = '__all__'
 
-    def validate(self, data):
-        request = self.context['request']
-        if (request.method == 'GET'
-            and Cart.objects.filter(
-                user=request.user,
-                recipe__id=data['recipe'].id).exists()):
-            raise serializers.ValidationError(
-                RECIPE_IS_ALREADY_IN_THE_SHOPPING_CART
-            )
-        return data
-
     def to_representation(self, instance):
         return ShortRecipeSerializer(
             instance.recipe,
@@ -1,111 +1,375 @@
-from django.db.models import F
-from django.shortcuts import get_object_or_404
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import (AutoField, BooleanField, DateTimeField,
+                              Exists, F, IntegerField, OuterRef, Prefetch,
+                              Sum, Value, prefetch_related_objects, sql)
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers, status
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from recipes.models import Ingredient, IngredientRecipe
+from recipes.models import (Cart, Favorite, Following, Ingredient,
+                            IngredientRecipe, Recipe, Tag)
+from recipes.utils import count_of
+from users.models import User
+from . import caching
 
-ENTRY_DUPLICATION_MESSAGE = _(
-    "ID '{}' duplicates provided list of IDs"
-)
 NEGATIVE_VALUE_NOT_ALLOWED = _(
     'Negative values are not allowed'
 )
+NO_INGREDIENTS_FOUND = _(
+    'There are no ingredients with IDs {} in the database'
+)
+RELATION_TARGET_NOT_FOUND = (
+    serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+)
+RELATION_NOT_FOUND = _('{} matching query does not exist.')
+USER_REQUIRED = serializers.Field.default_error_messages['null']
+BATCH_ADDED = 'added'
+BATCH_PRESENT = 'already_present'
+BATCH_REMOVED = 'removed'
+BATCH_NOT_FOUND = 'not_found'
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    Cart: 'in_carts_count',
+}
 
 
-def calculate_ingredients(ingredients, recipe):
-    '''Method adds ingredients to the recipe'''
+def change_recipes_count(author_id, delta):
+    '''Shifts denormalized number of recipes of the author'''
+    User.objects.filter(id=author_id).update(
+        recipes_count=F('recipes_count') + delta
+    )
+
+
+def change_recipe_counter(model, recipe_id, delta):
+    '''Shifts denormalized counter of the recipe kept for
+    Favorite or Cart model, other models are ignored'''
+    field = RECIPE_COUNTERS.get(model)
+    if field is not None:
+        Recipe.objects.filter(id=recipe_id).update(
+            **{field: F(field) + delta}
+        )
+
+
+def prepare_recipes(queryset, user):
+    '''Joins authors and annotates per-user flags once for the whole
+    page instead of running separate lookups for every recipe. Tags
+    and ingredient portions are only needed to render payloads missing
+    from the cache and are loaded by prefetch_recipe_details'''
+    queryset = queryset.select_related('author').defer('search_vector')
+    if user.is_anonymous:
+        return queryset
+    return queryset.annotate(
+        is_favorited=Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        is_in_shopping_cart=Exists(Cart.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        author_is_subscribed=Exists(Following.objects.filter(
+            user=user, author=OuterRef('author'))),
+    )
+
+
+def prefetch_recipe_details(recipes):
+    '''Loads tags and ingredient portions of the recipes
+    with a query per relation'''
+    prefetch_related_objects(
+        recipes,
+        Prefetch('tags', queryset=Tag.objects.all()),
+        Prefetch(
+            'portioned',
+            queryset=IngredientRecipe.objects.select_related('ingredient')
+        ),
+    )
+
+
+def merge_ingredient_amounts(ingredients):
+    '''Sums amounts of repeated lines and makes sure every referenced
+    ingredient exists. Lines already resolved by RecipeWriteSerializer
+    carry the Ingredient object and are not checked again.'''
+    amounts = defaultdict(int)
+    unresolved = set()
     for ingredient in ingredients:
-        obj = get_object_or_404(Ingredient, id=ingredient['id'])
-        amount = ingredient['amount']
-        if IngredientRecipe.objects.filter(
-                recipe=recipe,
-                ingredient=obj
-        ).exists():
-            amount += F('amount')
-        IngredientRecipe.objects.update_or_create(
-            recipe=recipe,
-            ingredient=obj,
-            defaults={'amount': amount}
+        amounts[ingredient['id']] += ingredient['amount']
+        if 'ingredient' not in ingredient:
+            unresolved.add(ingredient['id'])
+    if unresolved:
+        missing = unresolved - set(Ingredient.objects.filter(
+            id__in=unresolved).values_list('id', flat=True))
+        if missing:
+            raise NotFound(NO_INGREDIENTS_FOUND.format(
+                ', '.join(map(str, sorted(missing)))))
+    return amounts
+
+
+def calculate_ingredients(ingredients, recipe):
+    '''Method adds ingredients to the recipe. Repeated lines and lines
+    for ingredients already in the recipe are summed up, the whole set
+    is resolved with one IN query and written with bulk operations'''
+    with transaction.atomic():
+        amounts = merge_ingredient_amounts(ingredients)
+        existing = list(IngredientRecipe.objects.filter(
+            recipe=recipe, ingredient_id__in=amounts
+        ))
+        for portion in existing:
+            portion.amount += amounts.pop(portion.ingredient_id)
+        IngredientRecipe.objects.bulk_update(existing, ['amount'])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
         )
 
 
-def custom_get_method(request, get_serializer, key, value):
-    data = {'user': request.user.id,
-            key: value}
-    context = {'request': request}
-    serializer = get_serializer(data=data, context=context)
-    serializer.is_valid(raise_exception=True)
-    serializer.save()
-    return Response(
-        serializer.data,
-        status.HTTP_201_CREATED
+def sync_ingredients(ingredients, recipe):
+    '''Replaces ingredients of the recipe touching only the lines that
+    differ from the stored ones. Returns whether anything changed.'''
+    with transaction.atomic():
+        amounts = merge_ingredient_amounts(ingredients)
+        stored = {
+            portion.ingredient_id: portion
+            for portion in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        removed = set(stored) - set(amounts)
+        changed = []
+        for ingredient_id, portion in stored.items():
+            amount = amounts.get(ingredient_id, portion.amount)
+            if amount != portion.amount:
+                portion.amount = amount
+                changed.append(portion)
+        added = [
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in stored
+        ]
+        if removed:
+            IngredientRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientRecipe.objects.bulk_create(added)
+    return bool(removed or changed or added)
+
+
+def sync_tags(tags, recipe):
+    '''Replaces tags of the recipe inserting and deleting only
+    the difference. Returns whether anything changed.'''
+    through = Recipe.tags.through
+    submitted = {tag.id for tag in tags}
+    with transaction.atomic():
+        stored = set(through.objects.filter(
+            recipe=recipe).values_list('tag_id', flat=True))
+        removed, added = stored - submitted, submitted - stored
+        if removed:
+            through.objects.filter(
+                recipe=recipe, tag_id__in=removed
+            ).delete()
+        through.objects.bulk_create(
+            through(recipe=recipe, tag_id=tag_id) for tag_id in added
+        )
+    return bool(removed or added)
+
+
+def insert_ignoring_conflicts(instance):
+    '''Inserts the instance with a single INSERT that skips a row
+    violating a unique constraint instead of failing, returns
+    whether the row was written'''
+    model = type(instance)
+    using = router.db_for_write(model, instance=instance)
+    query = sql.InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(
+        [field for field in model._meta.concrete_fields
+         if not isinstance(field, AutoField)],
+        [instance]
     )
+    with connections[using].cursor() as cursor:
+        for statement, params in query.get_compiler(using).as_sql():
+            cursor.execute(statement, params)
+        return cursor.rowcount > 0
 
 
-def custom_delete_author_method(
-            request, class_name,
-            get_serializer,
-            key, value, message
-            ):
+def add_relation(request, serializer_class, key, value, message):
+    '''Links the user to the recipe or author with ID value.
+    Existing link is detected by the unique constraint on insert,
+    so there is no separate check and no race between requests'''
+    if not request.user.is_authenticated:
+        return Response(
+            {'user': [USER_REQUIRED]}, status=status.HTTP_400_BAD_REQUEST
+        )
+    model = serializer_class.Meta.model
+    target = model._meta.get_field(key).related_model.objects.filter(
+        pk=value).first()
+    not_found = Response(
+        {key: [RELATION_TARGET_NOT_FOUND.format(pk_value=value)]},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+    if target is None:
+        return not_found
+    instance = model(user=request.user, **{key: target})
     try:
-        follower = class_name.objects.get(
-            user=request.user.id, author=value)
-    except class_name.DoesNotExist as exception:
+        with transaction.atomic():
+            created = insert_ignoring_conflicts(instance)
+            if created and key == 'recipe':
+                change_recipe_counter(model, value, 1)
+    except IntegrityError:
+        # The target was deleted after it had been fetched
+        return not_found
+    if not created:
         return Response(
-            {"errors": f'{exception}'},
+            {api_settings.NON_FIELD_ERRORS_KEY: [message]},
             status=status.HTTP_400_BAD_REQUEST
         )
-    data = {
-        'user': request.user.id,
-        key: value
-    }
-    context = {'request': request}
-    serializer = get_serializer(data=data, context=context)
-    serializer.is_valid(raise_exception=True)
-    follower.delete()
+    caching.bump_user_version(request.user.id)
     return Response(
-        # message.format(value),
-        status=status.HTTP_204_NO_CONTENT
+        serializer_class(instance, context={'request': request}).data,
+        status.HTTP_201_CREATED
     )
 
 
-def custom_delete_recipe_method(
-            request, class_name,
-            get_serializer,
-            key, value, message
-            ):
-    try:
-        follower = class_name.objects.get(
-            user=request.user.id, recipe=value)
-    except class_name.DoesNotExist as exception:
+def remove_relation(request, model, key, value):
+    '''Unlinks the user from the recipe or author with ID value
+    with a single DELETE, its row count tells if the link existed'''
+    if not request.user.is_authenticated:
         return Response(
-            {"errors": f'{exception}'},
+            {'errors': RELATION_NOT_FOUND.format(model._meta.object_name)},
             status=status.HTTP_400_BAD_REQUEST
         )
-    data = {
-        'user': request.user.id,
-        key: value
-    }
-    context = {'request': request}
-    serializer = get_serializer(data=data, context=context)
-    serializer.is_valid(raise_exception=True)
-    follower.delete()
-    return Response(
-        # message.format(value),
-        status=status.HTTP_204_NO_CONTENT
+    with transaction.atomic():
+        deleted, _ = model.objects.filter(
+            user=request.user, **{key: value}).delete()
+        if deleted and key == 'recipe':
+            change_recipe_counter(model, value, -1)
+    if not deleted:
+        return Response(
+            {'errors': RELATION_NOT_FOUND.format(model._meta.object_name)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    caching.bump_user_version(request.user.id)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def add_relations(user, model, key, ids):
+    '''Links the user to every recipe or author from ids with one
+    bulk insert and returns the status of every id in input order.
+    Counters of the touched recipes are recomputed from the table,
+    so concurrent toggles can not make them drift'''
+    ids = list(dict.fromkeys(ids))
+    targets = model._meta.get_field(key).related_model.objects.filter(
+        pk__in=ids)
+    if key == 'author':
+        # Nobody can subscribe to themselves
+        targets = targets.exclude(pk=user.id)
+    found = set(targets.values_list('pk', flat=True))
+    with transaction.atomic():
+        present = set(model.objects.filter(
+            user=user, **{key + '__in': found}
+        ).values_list(key + '_id', flat=True))
+        added = found - present
+        model.objects.bulk_create(
+            [model(user=user, **{key + '_id': id}) for id in added],
+            ignore_conflicts=True
+        )
+        if added:
+            recount_recipe_counter(model, added, key)
+    if added:
+        caching.bump_user_version(user.id)
+    return [
+        {'id': id, 'status': (
+            BATCH_ADDED if id in added else
+            BATCH_PRESENT if id in present else
+            BATCH_NOT_FOUND
+        )}
+        for id in ids
+    ]
+
+
+def remove_relations(user, model, key, ids):
+    '''Unlinks the user from every recipe or author from ids with one
+    bulk delete and returns the status of every id in input order'''
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic():
+        links = model.objects.filter(user=user, **{key + '__in': ids})
+        removed = set(links.values_list(key + '_id', flat=True))
+        links.filter(**{key + '__in': removed}).delete()
+        if removed:
+            recount_recipe_counter(model, removed, key)
+    if removed:
+        caching.bump_user_version(user.id)
+    return [
+        {'id': id,
+         'status': BATCH_REMOVED if id in removed else BATCH_NOT_FOUND}
+        for id in ids
+    ]
+
+
+def add_favorites_to_cart(user):
+    '''Puts every favorite recipe of the user into the cart with a
+    single INSERT ... SELECT, returns the number of added recipes'''
+    using = router.db_for_write(Cart)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    # Annotations keep the order of the inserted columns
+    favorites = Favorite.objects.filter(user=user).order_by().annotate(
+        cart_user=Value(user.id, output_field=IntegerField()),
+        cart_recipe=F('recipe_id'),
+        cart_updated=Value(timezone.now(), output_field=DateTimeField()),
+        cart_active=Value(True, output_field=BooleanField()),
+    ).values_list('cart_user', 'cart_recipe', 'cart_updated', 'cart_active')
+    select, params = favorites.query.get_compiler(using).as_sql()
+    statement = '{} {} ({}) {} {}'.format(
+        connection.ops.insert_statement(ignore_conflicts=True),
+        quote(Cart._meta.db_table),
+        ', '.join(quote(Cart._meta.get_field(name).column)
+                  for name in ['user', 'recipe', 'updated', 'active']),
+        select,
+        connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)
     )
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute(statement, params)
+            added = cursor.rowcount
+        if added:
+            Recipe.objects.filter(watching__user=user).update(
+                in_carts_count=count_of(Cart, 'recipe')
+            )
+    if added:
+        caching.bump_user_version(user.id)
+    return added
 
 
-def list_contains_unique_objects(ids_list, id):
-    '''Function throughs validation error when
-    a queryset contains duplicates
-    '''
-    if id in ids_list:
-        raise serializers.ValidationError(
-                ENTRY_DUPLICATION_MESSAGE.format(id))
-    ids_list.append(id)
+def get_cart_ingredients(user):
+    '''Ingredients of the recipes in the cart of the user
+    with their total amounts, ordered by name. A single GROUP BY
+    over amounts of the carted recipes: the cart holds a recipe
+    once, so every amount is counted exactly once'''
+    return IngredientRecipe.objects.filter(recipe__goods__user=user).values(
+        'ingredient',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+    ).order_by('name', 'measurement_unit').annotate(total=Sum('amount'))
+
+
+def recount_recipe_counter(model, recipe_ids, key='recipe'):
+    '''Recomputes denormalized counter of the recipes kept for
+    Favorite or Cart model, other models are ignored'''
+    field = RECIPE_COUNTERS.get(model)
+    if field is not None and key == 'recipe':
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            **{field: count_of(model, 'recipe')}
+        )
+
+
+def find_duplicates(ids):
+    '''Returns sorted IDs occurring in the list more than once'''
+    return sorted(
+        item_id for item_id, count in Counter(ids).items() if count > 1
+    )
 
 
 def negative_value_constraint(value):
@@ -0,0 +1,215 @@
+import csv
+import json
+import os
+from hashlib import md5
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.translation import gettext_lazy as _
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+from recipes.models import Recipe
+from . import caching
+from .service_functions import get_cart_ingredients
+
+SHOPPING_LIST_CACHE_KEY = 'shopping-list:{}:{}:{}:{}'
+DOWNLOAD_CART_PRINT_LINE = '{} ({}) - {} \n'
+EMPTY_CART_LIST = _('Cart list is empty')
+SHOPPING_LIST_TITLE = _('Shopping list')
+FILE_NAME = 'shopping_list.{}'
+CSV_HEADER = ('name', 'measurement_unit', 'amount')
+PDF_FONT = 'ShoppingListFont'
+PDF_FALLBACK_FONT = 'Helvetica'
+PDF_FONT_SIZE = 12
+PDF_TITLE_SIZE = 16
+PDF_MARGIN = 20 * mm
+PDF_LINE_HEIGHT = 7 * mm
+# Size of chunks a rendered PDF document is streamed in
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class Echo:
+    '''File-like object returning what is written, so csv.writer
+    produces rows one by one instead of filling a buffer'''
+    def write(self, value):
+        return value
+
+
+def render_text(items):
+    empty = True
+    for item in items:
+        empty = False
+        yield DOWNLOAD_CART_PRINT_LINE.format(
+            item['name'], item['measurement_unit'], item['total']
+        )
+    if empty:
+        yield str(EMPTY_CART_LIST)
+
+
+def render_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for item in items:
+        yield writer.writerow(
+            (item['name'], item['measurement_unit'], item['total'])
+        )
+
+
+def render_json(items):
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + json.dumps({
+            'name': item['name'],
+            'measurement_unit': item['measurement_unit'],
+            'amount': item['total'],
+        }, ensure_ascii=False)
+        separator = ', '
+    yield ']'
+
+
+def get_pdf_font():
+    '''TrueType font with Cyrillic glyphs from SHOPPING_LIST_PDF_FONT,
+    built-in Helvetica when the file is missing'''
+    if PDF_FONT in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT
+    if not os.path.isfile(settings.SHOPPING_LIST_PDF_FONT):
+        return PDF_FALLBACK_FONT
+    pdfmetrics.registerFont(TTFont(PDF_FONT, settings.SHOPPING_LIST_PDF_FONT))
+    return PDF_FONT
+
+
+def render_pdf(items):
+    '''Cross-reference table of a PDF is written after all pages,
+    so the document is built whole and then yielded in chunks'''
+    font = get_pdf_font()
+    buffer = BytesIO()
+    document = canvas.Canvas(buffer, pagesize=A4)
+    document.setTitle(str(SHOPPING_LIST_TITLE))
+    height = A4[1]
+    document.setFont(font, PDF_TITLE_SIZE)
+    document.drawString(PDF_MARGIN, height - PDF_MARGIN,
+                        str(SHOPPING_LIST_TITLE))
+    y = height - PDF_MARGIN - 2 * PDF_LINE_HEIGHT
+    document.setFont(font, PDF_FONT_SIZE)
+    for line in render_text(items):
+        if y < PDF_MARGIN:
+            document.showPage()
+            document.setFont(font, PDF_FONT_SIZE)
+            y = height - PDF_MARGIN
+        document.drawString(PDF_MARGIN, y, line.strip())
+        y -= PDF_LINE_HEIGHT
+    document.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+class ShoppingListRenderer(BaseRenderer):
+    '''Renders aggregated cart items with a generator of chunks'''
+    charset = 'utf-8'
+
+    def generate(self, items):
+        raise NotImplementedError
+
+    def stream(self, items):
+        for chunk in self.generate(items):
+            yield chunk.encode(self.charset) if isinstance(
+                chunk, str) else chunk
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(self.stream(data))
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return '{}; charset={}'.format(self.media_type, self.charset)
+        return self.media_type
+
+
+class PDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def generate(self, items):
+        return render_pdf(items)
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def generate(self, items):
+        return render_csv(items)
+
+
+class TextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def generate(self, items):
+        return render_text(items)
+
+
+class JSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def generate(self, items):
+        return render_json(items)
+
+
+# The first renderer is used when the client accepts anything
+RENDERERS = (PDFRenderer, CSVRenderer, TextRenderer, JSONRenderer)
+
+
+def get_cache_key(user, renderer):
+    '''Changes with the set of recipes in the cart of the user,
+    with any edit of them and with the ingredients catalog'''
+    cart_version = md5()
+    for recipe in Recipe.objects.filter(goods__user=user).order_by(
+            'pk').values_list('pk', 'version').iterator():
+        cart_version.update('{}:{};'.format(*recipe).encode())
+    return SHOPPING_LIST_CACHE_KEY.format(
+        user.id, renderer.format, cart_version.hexdigest(),
+        caching.get_version(caching.INGREDIENTS_VERSION),
+    )
+
+
+def cache_stream(key, chunks):
+    '''Yields the chunks and caches the whole document once
+    it has been sent completely'''
+    rendered = []
+    for chunk in chunks:
+        rendered.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(rendered), settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def get_response(user, renderer):
+    '''Serves the shopping list of the user from the cache or streams
+    it row by row while rendering'''
+    key = get_cache_key(user, renderer)
+    content = cache.get(key)
+    if content is not None:
+        response = HttpResponse(content, content_type=renderer.content_type)
+    else:
+        response = StreamingHttpResponse(
+            cache_stream(key, renderer.stream(
+                get_cart_ingredients(user).iterator()
+            )),
+            content_type=renderer.content_type
+        )
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+        FILE_NAME.format(renderer.format)
+    )
+    patch_vary_headers(response, ['Accept', 'Authorization'])
+    return response
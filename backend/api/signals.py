@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+from . import caching, images
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tags_changed(**kwargs):
+    caching.bump_version(caching.TAGS_VERSION)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredients_changed(**kwargs):
+    caching.bump_version(caching.INGREDIENTS_VERSION)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipes_changed(**kwargs):
+    caching.bump_version(caching.RECIPES_VERSION)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    images.schedule_release(images.get_image_names(instance))
+
+
+@receiver(post_save, sender=User)
+def author_changed(update_fields=None, **kwargs):
+    '''Author profiles are part of recipe payloads,
+    logins only touch last_login and are skipped'''
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        caching.bump_version(caching.AUTHORS_VERSION)
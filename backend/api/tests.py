@@ -0,0 +1,510 @@
+import json
+import os
+import shutil
+import tempfile
+from base64 import b64decode
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from api import caching, images
+from api.ingredient_index import ingredient_index
+from api.service_functions import get_cart_ingredients
+from recipes.models import (Cart, Favorite, Ingredient, IngredientRecipe,
+                            Recipe, Tag)
+from users.models import User
+
+RECIPES_URL = '/api/recipes/'
+# 1x1 PNG
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAD'
+    'UlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+OTHER_PROCESS_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'other-process',
+}}
+# Versions for validators, page of recipes with flags, the count,
+# versions for payload keys, tags and ingredients
+RECIPE_PAGE_QUERIES = 6
+# Payloads and the count come from the cache
+CACHED_RECIPE_PAGE_QUERIES = 3
+
+
+class RecipeTestCase(APITestCase):
+    '''Creates a logged-in user, tags and ingredients,
+    recipes are made with the ORM so no images are stored'''
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='cook', email='cook@example.com', password='secret',
+            first_name='Cook', last_name='Cook',
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(name='Lunch', color='#49B64E',
+                                      slug='lunch')
+        self.ingredients = [
+            Ingredient.objects.create(name='ingredient {}'.format(number),
+                                      measurement_unit='g')
+            for number in range(40)
+        ]
+
+    def use_temporary_media(self):
+        '''Stores uploaded images in a directory removed after the test'''
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def make_recipe(self, name, amounts, author=None):
+        '''Recipe with ingredients given as {ingredient: amount}'''
+        recipe = Recipe.objects.create(
+            author=author or self.user, name=name, text=name,
+            cooking_time=5, image='recipes/image.png',
+        )
+        recipe.tags.add(self.tag)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+
+
+class FullTextSearchTest(RecipeTestCase):
+    '''Migrations rebuilding the recipes table on SQLite drop
+    the triggers maintaining the full-text index'''
+
+    def search(self, value):
+        response = self.client.get(RECIPES_URL, {'search': value})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_created_and_renamed_recipes_are_found(self):
+        recipe = self.make_recipe('Borscht', {self.ingredients[0]: 100})
+        self.assertEqual(self.search('borscht'), ['Borscht'])
+        recipe.name = recipe.text = 'Solyanka'
+        recipe.save()
+        self.assertEqual(self.search('borscht'), [])
+        self.assertEqual(self.search('solyanka'), ['Solyanka'])
+
+
+class RecipeListQueriesTest(RecipeTestCase):
+    '''Favorite and cart flags are annotated on the page,
+    so its cost does not grow with the page size'''
+
+    def setUp(self):
+        super().setUp()
+        for number in range(30):
+            recipe = self.make_recipe('recipe {}'.format(number), {
+                ingredient: 10 for ingredient in self.ingredients[:3]
+            })
+            if number % 2:
+                Favorite.objects.create(user=self.user, recipe=recipe)
+            else:
+                Cart.objects.create(user=self.user, recipe=recipe)
+        caching.bump_user_version(self.user.id)
+
+    def get_page(self, size):
+        response = self.client.get(RECIPES_URL, {'limit': size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), size)
+        return response
+
+    def assert_page_queries(self, size):
+        cache.clear()
+        with self.assertNumQueries(RECIPE_PAGE_QUERIES):
+            response = self.get_page(size)
+        for recipe in response.data['results']:
+            self.assertNotEqual(recipe['is_favorited'],
+                                recipe['is_in_shopping_cart'])
+
+    def test_page_queries_do_not_depend_on_page_size(self):
+        self.assert_page_queries(5)
+        self.assert_page_queries(25)
+
+    def test_cached_page_skips_tags_and_ingredients(self):
+        self.get_page(25)
+        with CaptureQueriesContext(connection) as context:
+            self.get_page(25)
+        self.assertEqual(len(context.captured_queries),
+                         CACHED_RECIPE_PAGE_QUERIES)
+        for query in context.captured_queries:
+            self.assertNotIn('search_vector', query['sql'])
+
+
+class RecipePayloadCacheTest(RecipeTestCase):
+    '''Cached recipe payloads follow changes of the catalogs'''
+
+    def test_renamed_tag_and_ingredient_are_shown(self):
+        recipe = self.make_recipe('soup', {self.ingredients[0]: 10})
+        self.client.get(RECIPES_URL)
+        self.tag.name = 'Dinner'
+        self.tag.save()
+        self.ingredients[0].name = 'salt'
+        self.ingredients[0].save()
+        response = self.client.get('{}{}/'.format(RECIPES_URL, recipe.id))
+        self.assertEqual(response.data['tags'][0]['name'], 'Dinner')
+        self.assertEqual(response.data['ingredients'][0]['name'], 'salt')
+
+
+class RecipeConditionalGetTest(RecipeTestCase):
+
+    def test_malformed_pk_is_not_found(self):
+        response = self.client.get(RECIPES_URL + 'abc/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_rendered_variants_change_validators(self):
+        self.use_temporary_media()
+        response = self.client.post(RECIPES_URL, {
+            'name': 'soup', 'text': 'soup', 'cooking_time': 5,
+            'image': IMAGE, 'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+        }, format='json')
+        url = '{}{}/'.format(RECIPES_URL, response.data['id'])
+        etag = self.client.get(url)['ETag']
+        # Variants are rendered once the transaction commits,
+        # which never happens inside a test case
+        images.make_variants(response.data['id'], Recipe.objects.get(
+            pk=response.data['id']).image.name)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CatalogVersionTest(RecipeTestCase):
+    '''Versions are shared by processes which do not share the cache'''
+    URL = '/api/ingredients/'
+
+    def test_change_made_by_another_process_is_served(self):
+        etag = self.client.get(self.URL)['ETag']
+        with override_settings(CACHES=OTHER_PROCESS_CACHES):
+            Ingredient.objects.create(name='salt', measurement_unit='g')
+        response = self.client.get(self.URL, {'name': 'sa'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.data], ['salt'])
+
+
+class LoadDataTest(RecipeTestCase):
+    '''Ingredients loaded by the command are served by processes
+    which do not share its cache'''
+    URL = '/api/ingredients/'
+
+    def test_loaded_ingredients_change_validators(self):
+        etag = self.client.get(self.URL)['ETag']
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'ingredients.csv')
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write('salt,g\n')
+        with override_settings(CACHES=OTHER_PROCESS_CACHES):
+            call_command('load_data', path, verbosity=0, stdout=StringIO())
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('salt', [item['name'] for item in response.data])
+
+
+class IngredientIndexTest(RecipeTestCase):
+
+    def test_index_follows_changes_of_other_processes(self):
+        self.assertEqual(ingredient_index.search('salt', 5), [])
+        with override_settings(CACHES=OTHER_PROCESS_CACHES):
+            salt = Ingredient.objects.create(name='Salt',
+                                             measurement_unit='g')
+        self.assertEqual(ingredient_index.search('salt', 5), [salt.id])
+        keys, ids = ingredient_index.refresh()
+        self.assertEqual(len(keys), len(ids))
+
+
+class RecipeWriteQueriesTest(RecipeTestCase):
+    '''Ingredients are written in bulk, so creating and updating
+    a recipe costs the same number of queries for any recipe size'''
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media()
+
+    def payload(self, name, ingredients):
+        return {
+            'name': name, 'text': name, 'cooking_time': 5, 'image': IMAGE,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in ingredients
+            ],
+        }
+
+    def count_queries(self, method, url, payload):
+        with CaptureQueriesContext(connection) as context:
+            response = method(url, payload, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        return len(context.captured_queries), response
+
+    def write_recipe(self, size):
+        '''Numbers of queries creating a recipe with size ingredients
+        and replacing all of them with other size ingredients'''
+        created, response = self.count_queries(
+            self.client.post, RECIPES_URL,
+            self.payload('recipe {}'.format(size), self.ingredients[:size])
+        )
+        updated, _ = self.count_queries(
+            self.client.put, '{}{}/'.format(RECIPES_URL, response.data['id']),
+            self.payload('renamed {}'.format(size),
+                         self.ingredients[20:20 + size])
+        )
+        return created, updated
+
+    def test_queries_do_not_depend_on_ingredient_count(self):
+        # Records versions of the data sets the first write changes
+        self.write_recipe(1)
+        self.assertEqual(self.write_recipe(2), self.write_recipe(20))
+
+
+class IdempotencyKeyTest(APITestCase):
+    '''Retries with the same Idempotency-Key get the stored response,
+    failed requests are executed again'''
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='guest', email='guest@example.com', password='secret',
+        )
+        self.client.force_authenticate(self.user)
+        self.soup, self.stew = (
+            Recipe.objects.create(
+                author=self.user, name=name, text=name, cooking_time=5,
+                image='recipes/image.png',
+            )
+            for name in ('soup', 'stew')
+        )
+
+    def post_favorites(self, recipe):
+        return self.client.post(
+            RECIPES_URL + 'favorite/batch/', {'ids': [recipe.id]},
+            format='json', HTTP_IDEMPOTENCY_KEY='batch'
+        )
+
+    def remove_favorite(self, recipe):
+        return self.client.delete(
+            '{}{}/favorite/'.format(RECIPES_URL, recipe.id),
+            HTTP_IDEMPOTENCY_KEY='remove'
+        )
+
+    def test_retry_is_replayed(self):
+        self.assertEqual(self.post_favorites(self.soup).status_code, 200)
+        Favorite.objects.all().delete()
+        response = self.post_favorites(self.soup)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_key_reused_for_different_body_is_rejected(self):
+        self.assertEqual(self.post_favorites(self.soup).status_code, 200)
+        self.assertEqual(self.post_favorites(self.stew).status_code, 422)
+
+    def test_failed_request_is_executed_again(self):
+        self.assertEqual(self.remove_favorite(self.soup).status_code, 400)
+        self.client.get('{}{}/favorite/'.format(RECIPES_URL, self.soup.id))
+        response = self.remove_favorite(self.soup)
+        self.assertEqual(response.status_code, 204)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertFalse(Favorite.objects.exists())
+
+
+class AnonymousRelationsTest(RecipeTestCase):
+    '''Anonymous users can not add or remove links, the refusal
+    is a validation error as before'''
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.make_recipe('soup', {})
+        self.client.force_authenticate(None)
+
+    def test_links_are_refused(self):
+        for url, model in (
+            ('{}{}/favorite/'.format(RECIPES_URL, self.recipe.id),
+             'Favorite'),
+            ('{}{}/shopping_cart/'.format(RECIPES_URL, self.recipe.id),
+             'Cart'),
+            ('/api/users/{}/subscribe/'.format(self.user.id), 'Following'),
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.data, {'user': ['This field may not be null.']}
+            )
+            response = self.client.delete(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data, {
+                'errors': '{} matching query does not exist.'.format(model)
+            })
+
+    def test_batch_links_require_authentication(self):
+        for url in ('/api/users/subscribe/batch/',
+                    RECIPES_URL + 'favorite/batch/',
+                    RECIPES_URL + 'shopping_cart/batch/'):
+            for method in (self.client.post, self.client.delete):
+                response = method(url, {'ids': [self.recipe.id]},
+                                  format='json')
+                self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            RECIPES_URL + 'shopping_cart/from_favorites/'
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class ReleaseFilesTest(RecipeTestCase):
+    '''Unreferenced files are deleted only after the grace period,
+    a reused file counts as just saved'''
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media()
+        self.name = default_storage.save('recipes/a.txt', ContentFile(b'a'))
+        path = default_storage.path(self.name)
+        os.utime(path, (0, 0))
+
+    def test_old_file_is_deleted(self):
+        images.release_files([self.name])
+        self.assertFalse(default_storage.exists(self.name))
+
+    def test_reused_file_is_kept(self):
+        self.assertEqual(
+            default_storage.save('recipes/b.txt', ContentFile(b'a')),
+            self.name
+        )
+        images.release_files([self.name])
+        self.assertTrue(default_storage.exists(self.name))
+
+
+class RequestSizeTest(RecipeTestCase):
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_large_json_body_is_refused(self):
+        response = self.client.post(RECIPES_URL, {
+            'name': 'soup', 'text': 'x' * 5000, 'cooking_time': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, 413)
+
+
+class ImportRecipesTest(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'recipes.ndjson')
+        os.mkdir(self.path + '_images')
+        with open(os.path.join(self.path + '_images', 'soup.png'),
+                  'wb') as file:
+            file.write(b64decode(IMAGE.split(',')[1]))
+        with open(self.path, 'w') as file:
+            json.dump({
+                'author': self.user.username, 'name': 'soup', 'text': 'soup',
+                'cooking_time': 5, 'image': 'recipes/soup.png',
+                'tags': [self.tag.slug], 'ingredients': [{
+                    'name': self.ingredients[0].name,
+                    'measurement_unit': 'g', 'amount': 1,
+                }],
+            }, file)
+
+    def test_image_details_are_stored(self):
+        output = StringIO()
+        call_command('import_recipes', self.path, verbosity=0, stdout=output)
+        self.assertEqual(
+            output.getvalue().strip(),
+            '1 recipes imported, 0 already present, 0 bad rows'
+        )
+        recipe = Recipe.objects.get()
+        self.assertEqual((recipe.image_width, recipe.image_height), (1, 1))
+        self.assertTrue(recipe.image_size)
+        self.assertTrue(recipe.image_placeholder)
+
+    def test_imported_recipes_change_validators(self):
+        etag = self.client.get(RECIPES_URL)['ETag']
+        with override_settings(CACHES=OTHER_PROCESS_CACHES):
+            call_command('import_recipes', self.path, verbosity=0,
+                         stdout=StringIO())
+        response = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['name'] for recipe in response.data['results']],
+            ['soup']
+        )
+
+
+class ShoppingListTest(RecipeTestCase):
+    URL = RECIPES_URL + 'download_shopping_cart/'
+
+    def put_in_cart(self, *recipes):
+        for recipe in recipes:
+            Cart.objects.create(user=self.user, recipe=recipe)
+
+    def get_list(self):
+        response = self.client.get(self.URL, {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        content = (
+            b''.join(response.streaming_content) if response.streaming
+            else response.content
+        )
+        return {
+            item['name']: item['amount'] for item in json.loads(content)
+        }
+
+    def test_deleted_recipe_leaves_cached_list(self):
+        soup = self.make_recipe('soup', {self.ingredients[0]: 10})
+        stew = self.make_recipe('stew', {self.ingredients[1]: 20})
+        self.put_in_cart(soup, stew)
+        self.get_list()
+        # Recipe versions of the cart sum up as before
+        stew.delete()
+        soup.save()
+        self.assertEqual(self.get_list(), {self.ingredients[0].name: 10})
+
+    def test_equal_amounts_of_different_recipes_are_summed(self):
+        salt, pepper, rice = self.ingredients[:3]
+        self.put_in_cart(
+            self.make_recipe('soup', {salt: 10, pepper: 5}),
+            self.make_recipe('stew', {salt: 10, rice: 200}),
+        )
+        self.make_recipe('pie', {salt: 100})
+        self.assertEqual(self.get_list(), {
+            salt.name: 20, pepper.name: 5, rice.name: 200,
+        })
+
+    def test_empty_cart(self):
+        self.make_recipe('soup', {self.ingredients[0]: 10})
+        self.assertEqual(self.get_list(), {})
+
+    def test_large_cart_is_aggregated_with_one_query(self):
+        recipes = [
+            self.make_recipe('recipe {}'.format(number), {
+                ingredient: number % 3 + 1
+                for ingredient in self.ingredients[number % 20:][:10]
+            })
+            for number in range(300)
+        ]
+        self.put_in_cart(*recipes)
+        expected = {}
+        for number in range(300):
+            for ingredient in self.ingredients[number % 20:][:10]:
+                expected[ingredient.name] = (
+                    expected.get(ingredient.name, 0) + number % 3 + 1
+                )
+        with self.assertNumQueries(1):
+            totals = {
+                item['name']: item['total']
+                for item in get_cart_ingredients(self.user)
+            }
+        self.assertEqual(totals, expected)
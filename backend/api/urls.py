@@ -28,12 +28,20 @@ authorisation = [
 urlpatterns = [
     path(r'users/subscriptions/',
          views.ListMyFollowingsViewSet.as_view({'get': 'list'}), name='subscriptions'),
+    path(r'users/subscribe/batch/',
+         views.ManageFollowingsBatchView.as_view(), name='subscribe-batch'),
     path(r'users/<int:user_id>/subscribe/',
          views.ManageFollowingsViewSet.as_view(), name='subscribe'),
     path(r'recipes/<int:recipe_id>/favorite/',
          views.ManageFavoritesViewSet.as_view(), name='favorites'),
+    path(r'recipes/favorite/batch/',
+         views.ManageFavoritesBatchView.as_view(), name='favorites-batch'),
     path(r'recipes/<int:recipe_id>/shopping_cart/',
          views.ManageCartView.as_view(), name='carts'),
+    path(r'recipes/shopping_cart/batch/',
+         views.ManageCartBatchView.as_view(), name='carts-batch'),
+    path(r'recipes/shopping_cart/from_favorites/',
+         views.FavoritesToCartView.as_view(), name='carts-from-favorites'),
     path(r'recipes/download_shopping_cart/',
          views.DownloadCartView.as_view(), name='carts'),
     path('auth/', include(authorisation)),
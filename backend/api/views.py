@@ -1,7 +1,8 @@
 from django.contrib.auth import update_session_auth_hash
-from django.db.models import Sum
+from django.db import transaction
 from django_filters.rest_framework.backends import DjangoFilterBackend
-from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import ugettext_lazy as _
 from djoser import utils
 from djoser.compat import get_user_email
@@ -11,35 +12,69 @@ from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import (permissions, status, views, viewsets)
 from rest_framework.decorators import action
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
+from rest_framework.renderers import JSONRenderer
 # from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import GenericViewSet
 
-from api.serializers import (RecipeWriteSerializer, FollowingBaseSerializer,
+from api.serializers import (ALREADY_SUBSCRIBED,
+                             RECIPE_IS_ALREADY_IN_FAVORITES,
+                             RECIPE_IS_ALREADY_IN_THE_SHOPPING_CART,
+                             UNABLE_TO_SIGN_FOR_YOURSELF,
+                             BatchSerializer, FollowingBaseSerializer,
                              IngredientSerializer, ManageCartSerializer,
                              ManageFavoriteSerializer, RecipeReadSerializer,
-                             SimpleFollowSerializer, SubscribersSerializer,
+                             RecipeWriteSerializer, SubscribersSerializer,
                              TagSerializer)
 from recipes.models import Cart, Favorite, Following, Ingredient, Recipe, Tag
 from users.models import User
-from . import service_functions
+from . import caching, service_functions, shopping_list
 from .filters import IngredientNameFilter, RecipeFilter
-from .paginators import CustomPageNumberPaginator
+from .idempotency import idempotent
+from .paginators import ApproximateCountPaginator, RecipeCursorPaginator
 from .permissions import IsAuthorOrAdminOrReadOnly
 
 OBJECT_NOT_FOUND = _('Object not found')
-SUCCESSFULLY_UNFOLLOWED = _(
-    'You have successfully unfollowed user with ID: {}')
 UNFOLLOW_USER = _('The user is unfollowed')
-RECIPE_REMOVED_FROM_FAVORITES = _(
-    'Recipe with ID {} successfully removed from your favorites'
-)
-RECIPE_REMOVED_FROM_CART = _(
-    'Recipe with ID {} has been succefully deleted from from your cart'
-)
 END_OF_LIST = _('End of list')
-DOWNLOAD_CART_PRINT_LINE = '{} ({}) - {} \n'
-EMPTY_CART_LIST = _('Cart list is empty')
+
+
+class ConditionalGetMixin:
+    '''Answers list and retrieve with 304 Not Modified when ETag or
+    Last-Modified built from get_versions match the request, before
+    the queryset is evaluated or any serializer work is done'''
+    def get_versions(self, request):
+        '''Returns timestamps of data the response depends on
+        or None when validators are not available'''
+        return None
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        versions = self.get_versions(request)
+        if versions is None:
+            return handler(request, *args, **kwargs)
+        etag = quote_etag(caching.make_etag(request.user.id, *versions))
+        last_modified = int(max(versions))
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
 
 
 class ListRetriveViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
@@ -93,15 +128,18 @@ class CustomTokenDestroyView(TokenDestroyView):
         return Response(status=status.HTTP_201_CREATED)
 
 
-class TagViewSet(ListRetriveViewSet):
+class TagViewSet(ConditionalGetMixin, ListRetriveViewSet):
     '''Viewset for Tags'''
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [permissions.AllowAny, ]
     http_method_names = ['get']
 
+    def get_versions(self, request):
+        return (caching.get_version(caching.TAGS_VERSION),)
+
 
-class IngredientViewSet(ListRetriveViewSet):
+class IngredientViewSet(ConditionalGetMixin, ListRetriveViewSet):
     '''Viewset for ingredirents'''
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -110,18 +148,77 @@ class IngredientViewSet(ListRetriveViewSet):
     filterset_class = IngredientNameFilter
     http_method_names = ['get']
 
-class RecipeViewSet(viewsets.ModelViewSet):
+    def get_versions(self, request):
+        return (caching.get_version(caching.INGREDIENTS_VERSION),)
+
+
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     '''Viewset for viewing and managing Recipes'''
     filterset_class = RecipeFilter
     filter_backends = (DjangoFilterBackend,)
     permission_classes = [IsAuthorOrAdminOrReadOnly]
-    pagination_class = CustomPageNumberPaginator
+    pagination_class = ApproximateCountPaginator
     queryset = Recipe.objects.all()
     http_method_names = ['get', 'post', 'put', 'patch', 'delete']
 
+    @property
+    def paginator(self):
+        '''Switches to keyset pagination when the client
+        passes the cursor query parameter'''
+        if not hasattr(self, '_paginator'):
+            cursor_param = RecipeCursorPaginator.cursor_query_param
+            self._paginator = (
+                RecipeCursorPaginator()
+                if cursor_param in self.request.query_params
+                else self.pagination_class()
+            )
+        return self._paginator
+
+    def get_versions(self, request):
+        '''Recipe list depends on the whole recipe table, single recipe
+        on its own modification time and version, both on catalogs, author
+        profiles and per-user flags of the viewer'''
+        names = [
+            caching.TAGS_VERSION, caching.INGREDIENTS_VERSION,
+            caching.AUTHORS_VERSION,
+        ]
+        if self.action == 'retrieve':
+            try:
+                modified = Recipe.objects.filter(
+                    pk=self.kwargs.get(self.lookup_field)
+                ).values_list('updated', 'version').first()
+            except (ValueError, TypeError):
+                # Malformed pk, get_object() answers with 404
+                return None
+            if modified is None:
+                return None
+            updated, version = modified
+            changed = (updated.timestamp(), version)
+        else:
+            changed = ()
+            names.append(caching.RECIPES_VERSION)
+        user_version = caching.get_user_version_name(request.user)
+        if user_version is not None:
+            names.append(user_version)
+        return (*changed, *caching.get_versions(*names))
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return service_functions.prepare_recipes(
+            super().get_queryset(), self.request.user
+        )
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            service_functions.change_recipes_count(instance.author_id, -1)
+
     def get_serializer_class(self):
         return (
             RecipeReadSerializer if self.action in ['get', 'list', 'retrieve'] else
@@ -131,7 +228,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
 class ListMyFollowingsViewSet(viewsets.ModelViewSet):
     '''Viewset for list of followings (subscriptions)'''
     serializer_class = SubscribersSerializer
-    pagination_class = CustomPageNumberPaginator
+    pagination_class = ApproximateCountPaginator
     http_method_names = ['get']
 
     def get_queryset(self):
@@ -140,99 +237,132 @@ class ListMyFollowingsViewSet(viewsets.ModelViewSet):
 
 class ManageFollowingsViewSet(views.APIView):
     ''' Viewset for adding or removing following (subscriptions) for a user'''
-    def get_queryset(self):
-        return Following.objects.all()
-
-    def get_serializer_class(self, *args, **kwargs):
-        return (
-            FollowingBaseSerializer(*args, **kwargs) if
-            self.request.method == 'GET' else
-            SimpleFollowSerializer(*args, **kwargs)
-        )
-
+    @idempotent
     def get(self, request, user_id):
-        key, value = 'author', user_id
-        return service_functions.custom_get_method(
-            request,
-            self.get_serializer_class,
-            key, value)
+        if user_id == request.user.id:
+            return Response(
+                {api_settings.NON_FIELD_ERRORS_KEY: [
+                    UNABLE_TO_SIGN_FOR_YOURSELF
+                ]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return service_functions.add_relation(
+            request, FollowingBaseSerializer,
+            'author', user_id, ALREADY_SUBSCRIBED
+        )
 
+    @idempotent
     def delete(self, request, user_id):
-        key, value = 'author', user_id
-        return service_functions.custom_delete_author_method(
-            request, Following,
-            self.get_serializer_class,
-            key, value, SUCCESSFULLY_UNFOLLOWED
-            )
+        return service_functions.remove_relation(
+            request, Following, 'author', user_id
+        )
 
 
 class ManageFavoritesViewSet(views.APIView):
     ''' Viewset for adding or removing recipes
     to/from Favorites for a user'''
+    @idempotent
     def get(self, request, recipe_id):
-        key, value = 'recipe', recipe_id
-        return service_functions.custom_get_method(
-            request,
-            ManageFavoriteSerializer,
-            key, value
+        return service_functions.add_relation(
+            request, ManageFavoriteSerializer,
+            'recipe', recipe_id, RECIPE_IS_ALREADY_IN_FAVORITES
         )
 
+    @idempotent
     def delete(self, request, recipe_id):
-        key, value = 'recipe', recipe_id
-        return service_functions.custom_delete_recipe_method(
-            request, Favorite,
-            ManageFavoriteSerializer,
-            key, value, RECIPE_REMOVED_FROM_FAVORITES
-            )
+        return service_functions.remove_relation(
+            request, Favorite, 'recipe', recipe_id
+        )
 
 
 class ManageCartView(views.APIView):
     ''' Viewset for adding or removing recipes
     to/from Cart (purchase list) of a user'''
+    @idempotent
     def get(self, request, recipe_id):
-        key, value = 'recipe', recipe_id
-        return service_functions.custom_get_method(
-            request,
-            ManageCartSerializer,
-            key, value
+        return service_functions.add_relation(
+            request, ManageCartSerializer,
+            'recipe', recipe_id, RECIPE_IS_ALREADY_IN_THE_SHOPPING_CART
         )
 
+    @idempotent
     def delete(self, request, recipe_id):
-        key, value = 'recipe', recipe_id
-        return service_functions.custom_delete_recipe_method(
-            request, Cart,
-            ManageCartSerializer,
-            key, value, RECIPE_REMOVED_FROM_CART
+        return service_functions.remove_relation(
+            request, Cart, 'recipe', recipe_id
         )
 
 
+class ManageRelationsBatchView(views.APIView):
+    '''Base view for adding or removing links of a user to several
+    recipes or authors at once, IDs are passed in the request body'''
+    permission_classes = [permissions.IsAuthenticated]
+    model = None
+    key = None
+
+    def get_ids(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['ids']
+
+    @idempotent
+    def post(self, request):
+        return Response({'results': service_functions.add_relations(
+            request.user, self.model, self.key, self.get_ids(request)
+        )})
+
+    @idempotent
+    def delete(self, request):
+        return Response({'results': service_functions.remove_relations(
+            request.user, self.model, self.key, self.get_ids(request)
+        )})
+
+
+class ManageFollowingsBatchView(ManageRelationsBatchView):
+    '''Viewset for following or unfollowing several authors'''
+    model = Following
+    key = 'author'
+
+
+class ManageFavoritesBatchView(ManageRelationsBatchView):
+    '''Viewset for adding or removing several recipes
+    to/from Favorites'''
+    model = Favorite
+    key = 'recipe'
+
+
+class ManageCartBatchView(ManageRelationsBatchView):
+    '''Viewset for adding or removing several recipes
+    to/from Cart'''
+    model = Cart
+    key = 'recipe'
+
+
+class FavoritesToCartView(views.APIView):
+    '''Viewset for adding all favorite recipes of a user to the Cart'''
+    permission_classes = [permissions.IsAuthenticated]
+
+    @idempotent
+    def post(self, request):
+        return Response({
+            'added': service_functions.add_favorites_to_cart(request.user)
+        })
+
+
 class DownloadCartView(views.APIView):
     '''Viewset for downloading current user's cart content
-    decomposed by ingredients in file in .pdf format
+    decomposed by ingredients as PDF, CSV, plain text or JSON file,
+    chosen by Accept header or format query parameter
      '''
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = shopping_list.RENDERERS
+
     def get(self, request):
-        cart = request.user.cart_holder.values(
-            'recipe__ingredients__name',
-            'recipe__ingredients__measurement_unit'
-        ).order_by('recipe__ingredients__name').annotate(
-            total=Sum('recipe__portioned__amount',
-                      distinct=True)
+        return shopping_list.get_response(
+            request.user, request.accepted_renderer
         )
 
-        output_list = []
-        for item in cart:
-            output_list.append(
-                DOWNLOAD_CART_PRINT_LINE.format(
-                    item.get('recipe__ingredients__name'),
-                    item.get('recipe__ingredients__measurement_unit'),
-                    item.get('total')
-                )
-            )
-
-        if len(output_list) == 0:
-            output_list = EMPTY_CART_LIST
-        response = HttpResponse(
-            output_list,
-            'Content-Type: application/pdf')
-        response['Content-Disposition'] = "attachment; filename='cart.pdf'"
-        return response
+    def handle_exception(self, exc):
+        # Errors are reported as JSON whatever file format was asked
+        self.request.accepted_renderer = JSONRenderer()
+        self.request.accepted_media_type = JSONRenderer.media_type
+        return super().handle_exception(exc)
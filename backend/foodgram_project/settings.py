@@ -49,6 +49,7 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
@@ -86,6 +87,15 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', default=''),
+    }
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -112,8 +122,59 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
     ],
+
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.SizeLimitedJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.environ.get(
+    'PAGINATION_COUNT_CACHE_TIMEOUT', default=30))
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(os.environ.get(
+    'PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=100000))
+RECIPE_CACHE_TIMEOUT = int(os.environ.get(
+    'RECIPE_CACHE_TIMEOUT', default=3600))
+INGREDIENT_SEARCH_LIMIT = int(os.environ.get(
+    'INGREDIENT_SEARCH_LIMIT', default=50))
+IDEMPOTENCY_KEY_TIMEOUT = int(os.environ.get(
+    'IDEMPOTENCY_KEY_TIMEOUT', default=86400))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get(
+    'IDEMPOTENCY_LOCK_TIMEOUT', default=60))
+BATCH_SIZE_LIMIT = int(os.environ.get(
+    'BATCH_SIZE_LIMIT', default=100))
+IMAGE_WORKER_THREADS = int(os.environ.get(
+    'IMAGE_WORKER_THREADS', default=2))
+IMAGE_THUMBNAIL_WIDTH = int(os.environ.get(
+    'IMAGE_THUMBNAIL_WIDTH', default=480))
+IMAGE_THUMBNAIL_HEIGHT = int(os.environ.get(
+    'IMAGE_THUMBNAIL_HEIGHT', default=320))
+IMAGE_DISPLAY_SIZE = int(os.environ.get(
+    'IMAGE_DISPLAY_SIZE', default=1280))
+IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', default='WEBP')
+IMAGE_VARIANT_QUALITY = int(os.environ.get(
+    'IMAGE_VARIANT_QUALITY', default=80))
+# Unreferenced media files saved less than this number of seconds ago
+# are kept, they may belong to a not yet committed upload
+MEDIA_RELEASE_GRACE = int(os.environ.get(
+    'MEDIA_RELEASE_GRACE', default=3600))
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get(
+    'IMAGE_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024))
+IMAGE_UPLOAD_MAX_PIXELS = int(os.environ.get(
+    'IMAGE_UPLOAD_MAX_PIXELS', default=40_000_000))
+# Base64 grows the image by a third, bigger bodies are rejected
+# before they are read: forms by Django, JSON by api.parsers
+DATA_UPLOAD_MAX_MEMORY_SIZE = IMAGE_UPLOAD_MAX_BYTES * 4 // 3 + 1024 * 1024
+SHOPPING_LIST_CACHE_TIMEOUT = int(os.environ.get(
+    'SHOPPING_LIST_CACHE_TIMEOUT', default=3600))
+# TrueType font with Cyrillic glyphs for PDF shopping lists
+SHOPPING_LIST_PDF_FONT = os.environ.get(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+SEARCH_CONFIG = os.environ.get('SEARCH_CONFIG', default='russian')
+
 DJOSER = {
     'SERIALIZERS': {
         'user': 'api.serializers.UserSerializer',
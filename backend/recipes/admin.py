@@ -45,6 +45,8 @@ class RecipeAdmin(admin.ModelAdmin):
         'cooking_time',
         'author',
         'pub_date',
+        'favorites_count',
+        'in_carts_count',
         )
     inlines = (RecipeIngredientInLine,)
 
@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def restore_fts_triggers(sender, using, **kwargs):
+    from .search import ensure_fts_triggers
+    ensure_fts_triggers(using)
 
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        post_migrate.connect(restore_fts_triggers, sender=self)
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from api import caching, images
+from recipes.models import Recipe
+
+BACKFILLED_MESSAGE = _('Image details stored for {} recipes, {} failed')
+FAILED_MESSAGE = _('Recipe {}: {}')
+META_FIELDS = [
+    'image_width', 'image_height', 'image_size', 'image_placeholder',
+    'version', 'updated',
+]
+
+
+class Command(BaseCommand):
+    help = "Store dimensions, size and placeholder of recipe images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--variants', action='store_true',
+            help='Also render missing thumbnail and display variants'
+        )
+
+    def handle(self, *args, **options):
+        described = failed = 0
+        queryset = Recipe.objects.filter(
+            image_width__isnull=True
+        ).exclude(image='').order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).only(
+                'pk', 'image', 'version'
+            )[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            updated = []
+            now = timezone.now()
+            for recipe in batch:
+                try:
+                    with recipe.image.open('rb') as image:
+                        details = images.describe_image(image)
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(FAILED_MESSAGE.format(recipe.pk, error))
+                    continue
+                for field, value in details.items():
+                    setattr(recipe, field, value)
+                # Cached payloads and validators of conditional
+                # GETs of the previous version are outdated
+                recipe.version += 1
+                recipe.updated = now
+                updated.append(recipe)
+            Recipe.objects.bulk_update(updated, META_FIELDS)
+            described += len(updated)
+        if options['variants']:
+            for pk, name in Recipe.objects.filter(
+                    image_thumbnail='').exclude(image='').values_list(
+                    'pk', 'image').iterator():
+                images.render_safely(pk, name)
+        if described:
+            caching.bump_version(caching.RECIPES_VERSION)
+        return str(BACKFILLED_MESSAGE.format(described, failed))
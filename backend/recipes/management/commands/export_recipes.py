@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from django.utils.translation import ugettext_lazy as _
+
+from recipes.management.commands.load_data import open_text
+from recipes.models import IngredientRecipe, Recipe
+
+EXPORTED_MESSAGE = _('{} recipes exported to {}, images saved to {}')
+PROGRESS_MESSAGE = _('{} recipes exported')
+
+
+def serialize_recipe(recipe, image_name):
+    '''Line of the export, related objects are referenced by natural
+    keys so the file can be imported into another database'''
+    return {
+        'author': recipe.author.username,
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'pub_date': recipe.pub_date.isoformat(),
+        'image': image_name,
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': portion.ingredient.name,
+                'measurement_unit': portion.ingredient.measurement_unit,
+                'amount': portion.amount,
+            }
+            for portion in recipe.portioned.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = "Export recipes to NDJSON file and directory of images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='NDJSON file, compressed with gzip if ends with .gz'
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Directory for images, defaults to <path>_images'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        images_dir = options['images_dir'] or path + '_images'
+        os.makedirs(images_dir, exist_ok=True)
+        exported = 0
+        with open_text(path, 'w') as output:
+            for batch in self.iterate_batches(options['batch_size']):
+                for recipe in batch:
+                    image_name = self.copy_image(recipe, images_dir)
+                    output.write(json.dumps(
+                        serialize_recipe(recipe, image_name),
+                        ensure_ascii=False
+                    ) + '\n')
+                exported += len(batch)
+                if options['verbosity']:
+                    self.stdout.write(PROGRESS_MESSAGE.format(exported))
+        return str(EXPORTED_MESSAGE.format(exported, path, images_dir))
+
+    def iterate_batches(self, batch_size):
+        '''Walks the table by primary key, so only one batch
+        with its tags and ingredients is held in memory'''
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'portioned',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        ).order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def copy_image(self, recipe, images_dir):
+        '''Copies the image under a name prefixed with the recipe ID,
+        which keeps names unique within the directory'''
+        if not recipe.image:
+            return None
+        name = '{}_{}'.format(recipe.pk, os.path.basename(recipe.image.name))
+        with recipe.image.open('rb') as source, open(
+                os.path.join(images_dir, name), 'wb') as target:
+            shutil.copyfileobj(source, target)
+        return name
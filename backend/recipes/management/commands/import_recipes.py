@@ -0,0 +1,239 @@
+import json
+import os
+from collections import defaultdict
+from itertools import islice
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext_lazy as _
+
+from api import caching, images
+from recipes.management.commands.load_data import open_text
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.search import refresh_search_vectors
+from recipes.utils import count_of
+from users.models import User
+
+# Keeps the number of query parameters within SQLite limit
+PUB_DATE_CHUNK = 200
+IMPORTED_MESSAGE = _(
+    '{} recipes imported, {} already present, {} bad rows'
+)
+PROGRESS_MESSAGE = _('{} lines read')
+BAD_ROW_MESSAGE = _('Line {}: {}')
+UNKNOWN_AUTHOR = _("Unknown author '{}'")
+UNKNOWN_TAG = _("Unknown tag '{}'")
+UNKNOWN_INGREDIENT = _("Unknown ingredient '{}' ({})")
+IMAGE_NOT_FOUND = _("Image '{}' not found")
+INVALID_IMAGE = _("Image '{}' is not a valid image")
+INVALID_COOKING_TIME = _('Cooking time must be a positive integer')
+INVALID_AMOUNT = _('Amount of ingredient must be a positive integer')
+MISSING_FIELD = _("Field '{}' is required")
+EXPECTED_OBJECT = _('Line must be a JSON object')
+
+
+class Command(BaseCommand):
+    help = "Import recipes from NDJSON file made by export_recipes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='NDJSON file, compressed with gzip if ends with .gz'
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Directory of images, defaults to <path>_images'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--max-errors', type=int, default=20,
+            help='Number of bad rows printed in the report'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.images_dir = options['images_dir'] or path + '_images'
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.bad_rows = []
+        self.imported = self.present = read = 0
+        with open_text(path) as stream:
+            lines = enumerate(stream, start=1)
+            while True:
+                batch = list(islice(lines, options['batch_size']))
+                if not batch:
+                    break
+                self.import_batch(batch)
+                read += len(batch)
+                if options['verbosity']:
+                    self.stdout.write(PROGRESS_MESSAGE.format(read))
+        if self.imported:
+            # bulk_create and update send no signals, so the versions
+            # of recipes and of their authors kept in the database are
+            # bumped here for every server process
+            caching.bump_version(caching.RECIPES_VERSION)
+            caching.bump_version(caching.AUTHORS_VERSION)
+        for number, error in self.bad_rows[:options['max_errors']]:
+            self.stderr.write(BAD_ROW_MESSAGE.format(number, error))
+        return str(IMPORTED_MESSAGE.format(
+            self.imported, self.present, len(self.bad_rows)
+        ))
+
+    def import_batch(self, batch):
+        '''Resolves natural keys of the batch with a query per model
+        and writes it in one transaction with bulk inserts'''
+        items = []
+        for number, line in batch:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as error:
+                self.bad_rows.append((number, error))
+                continue
+            if not isinstance(item, dict):
+                self.bad_rows.append((number, EXPECTED_OBJECT))
+                continue
+            items.append((number, item))
+        if not items:
+            return
+        self.authors = dict(User.objects.filter(username__in={
+            item.get('author') for _, item in items
+        }).values_list('username', 'id'))
+        self.ingredients = {
+            (name, unit): id for name, unit, id in Ingredient.objects.filter(
+                name__in={
+                    line.get('name')
+                    for _, item in items
+                    for line in item.get('ingredients') or []
+                    if isinstance(line, dict)
+                }
+            ).values_list('name', 'measurement_unit', 'id')
+        }
+        recipes = {}
+        valid = 0
+        for number, item in items:
+            try:
+                recipe = self.build_recipe(item)
+            except (ValueError, TypeError, AttributeError) as error:
+                self.bad_rows.append((number, error))
+                continue
+            valid += 1
+            recipes.setdefault((recipe.author_id, recipe.fingerprint), recipe)
+        existing = set(Recipe.objects.filter(
+            author_id__in={author for author, _ in recipes},
+            fingerprint__in={fingerprint for _, fingerprint in recipes},
+        ).values_list('author_id', 'fingerprint'))
+        new = [recipes[key] for key in recipes if key not in existing]
+        # Recipes repeated in the file or already in the database
+        self.present += valid - len(new)
+        if new:
+            self.write_recipes(new)
+
+    def build_recipe(self, item):
+        '''Unsaved recipe with IDs of tags and ingredient amounts
+        attached, raises ValueError for a line that can not be imported'''
+        for field in ('author', 'name', 'text', 'cooking_time', 'image'):
+            if not item.get(field):
+                raise ValueError(MISSING_FIELD.format(field))
+        if item['author'] not in self.authors:
+            raise ValueError(UNKNOWN_AUTHOR.format(item['author']))
+        cooking_time = item['cooking_time']
+        if not isinstance(cooking_time, int) or cooking_time < 1:
+            raise ValueError(INVALID_COOKING_TIME)
+        image = os.path.join(self.images_dir, os.path.basename(item['image']))
+        if not os.path.isfile(image):
+            raise ValueError(IMAGE_NOT_FOUND.format(item['image']))
+        tags = []
+        for slug in item.get('tags') or []:
+            if slug not in self.tags:
+                raise ValueError(UNKNOWN_TAG.format(slug))
+            tags.append(self.tags[slug])
+        amounts = defaultdict(int)
+        for line in item.get('ingredients') or []:
+            key = (line.get('name'), line.get('measurement_unit'))
+            if key not in self.ingredients:
+                raise ValueError(UNKNOWN_INGREDIENT.format(*key))
+            amount = line.get('amount')
+            if not isinstance(amount, int) or amount < 1:
+                raise ValueError(INVALID_AMOUNT)
+            amounts[self.ingredients[key]] += amount
+        try:
+            with open(image, 'rb') as file:
+                details = images.describe_image(File(file))
+        except OSError:
+            raise ValueError(INVALID_IMAGE.format(item['image']))
+        recipe = Recipe(
+            author_id=self.authors[item['author']],
+            name=item['name'],
+            text=item['text'],
+            cooking_time=cooking_time,
+            fingerprint=Recipe.make_fingerprint(item['name'], item['text']),
+            **details
+        )
+        recipe.tag_ids = set(tags)
+        recipe.amounts = amounts
+        recipe.image_path = image
+        recipe.exported_pub_date = parse_datetime(item.get('pub_date') or '')
+        return recipe
+
+    def write_recipes(self, recipes):
+        '''Stores images and inserts recipes, ingredient lines and tags
+        with bulk_create. IDs of inserted recipes are read back by
+        author and fingerprint, bulk_create does not set them on
+        every backend'''
+        for recipe in recipes:
+            with open(recipe.image_path, 'rb') as image:
+                recipe.image.save(
+                    os.path.basename(recipe.image_path), File(image),
+                    save=False
+                )
+        with transaction.atomic():
+            Recipe.objects.bulk_create(recipes)
+            ids = {
+                (author, fingerprint): id
+                for author, fingerprint, id in Recipe.objects.filter(
+                    author_id__in={recipe.author_id for recipe in recipes},
+                    fingerprint__in={recipe.fingerprint for recipe in recipes},
+                ).values_list('author_id', 'fingerprint', 'id')
+            }
+            for recipe in recipes:
+                recipe.pk = ids[(recipe.author_id, recipe.fingerprint)]
+            IngredientRecipe.objects.bulk_create([
+                IngredientRecipe(
+                    recipe_id=recipe.pk, ingredient_id=ingredient,
+                    amount=amount
+                )
+                for recipe in recipes
+                for ingredient, amount in recipe.amounts.items()
+            ])
+            Through = Recipe.tags.through
+            Through.objects.bulk_create([
+                Through(recipe_id=recipe.pk, tag_id=tag)
+                for recipe in recipes for tag in recipe.tag_ids
+            ])
+            self.restore_pub_dates(recipes)
+            refresh_search_vectors(
+                Recipe.objects.filter(pk__in=[r.pk for r in recipes])
+            )
+            User.objects.filter(
+                pk__in={recipe.author_id for recipe in recipes}
+            ).update(recipes_count=count_of(Recipe, 'author'))
+            for recipe in recipes:
+                images.schedule_variants(recipe)
+        self.imported += len(recipes)
+
+    def restore_pub_dates(self, recipes):
+        '''bulk_create sets auto_now_add fields to the current time,
+        exported publication dates are written back afterwards'''
+        dated = [r for r in recipes if r.exported_pub_date is not None]
+        for start in range(0, len(dated), PUB_DATE_CHUNK):
+            chunk = dated[start:start + PUB_DATE_CHUNK]
+            Recipe.objects.filter(pk__in=[r.pk for r in chunk]).update(
+                pub_date=Case(
+                    *[When(pk=r.pk, then=Value(r.exported_pub_date))
+                      for r in chunk],
+                    output_field=DateTimeField()
+                )
+            )
@@ -1,24 +1,207 @@
 import csv
+import gzip
+import json
+import re
+from itertools import chain, islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils.translation import ugettext_lazy as _
 
+from api import caching
 from recipes.models import Ingredient
 
+DEFAULT_PATH = 'recipes/data/ingredients.csv'
+FORMATS = ('csv', 'json')
+NAME_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+LOADED_MESSAGE = _(
+    'Data was successfully loaded to the database: {} rows read, '
+    '{} ingredients added, {} bad rows'
+)
+PROGRESS_MESSAGE = _('{} rows read')
+BAD_ROW_MESSAGE = _('Row {}: {} ({})')
+EXPECTED_TWO_VALUES = _('expected name and measurement unit')
+EMPTY_VALUE = _('name and measurement unit can not be empty')
+VALUE_TOO_LONG = _('value is longer than {} characters')
+UNKNOWN_FORMAT = _('Unable to detect format of {}, use --format')
+FILE_NOT_FOUND = _('File {} does not exist')
+MALFORMED_JSON = _('Malformed JSON array: {}')
+UNTERMINATED_ARRAY = _('array is not closed')
+EXPECTED_COMMA = _("expected ',' or ']', got {!r}")
+# Number of characters of a JSON array read at once
+JSON_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def open_text(path, mode='r'):
+    '''Opens plain or gzip compressed text file'''
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def detect_format(path):
+    extension = path[:-3] if path.endswith('.gz') else path
+    extension = extension.rsplit('.', 1)[-1].lower()
+    if extension not in FORMATS:
+        raise CommandError(UNKNOWN_FORMAT.format(path))
+    return extension
+
+
+def read_csv(stream):
+    yield from csv.reader(stream)
+
+
+def read_json(stream):
+    '''Reads array of objects or of [name, unit] pairs, or
+    JSON Lines with one such item per line. Both are streamed,
+    items of an array are decoded one by one'''
+    head = stream.read(1)
+    while head.isspace():
+        head = stream.read(1)
+    if head == '[':
+        items = read_json_array(stream)
+    else:
+        items = (
+            parse_json_line(line)
+            for line in chain([head + stream.readline()], stream)
+            if line.strip()
+        )
+    for item in items:
+        if isinstance(item, dict):
+            yield [item.get('name'), item.get('measurement_unit')]
+        else:
+            yield item
+
+
+def read_json_array(stream):
+    '''Yields items of a JSON array whose opening bracket is already
+    read, keeping only the unparsed tail of the last read in memory'''
+    decoder = json.JSONDecoder()
+    buffer, position, finished = '', 0, False
+    expect_item = True
+
+    def read_more():
+        nonlocal buffer, position, finished
+        chunk = stream.read(JSON_CHUNK_SIZE)
+        buffer, position = buffer[position:] + chunk, 0
+        finished = not chunk
+
+    while True:
+        position = JSON_WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if finished:
+                raise CommandError(MALFORMED_JSON.format(UNTERMINATED_ARRAY))
+            read_more()
+            continue
+        char = buffer[position]
+        if char == ']':
+            return
+        if not expect_item:
+            if char != ',':
+                raise CommandError(MALFORMED_JSON.format(
+                    EXPECTED_COMMA.format(char)
+                ))
+            position, expect_item = position + 1, True
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError as error:
+            if finished:
+                raise CommandError(MALFORMED_JSON.format(error))
+            read_more()
+            continue
+        # A value ending with the buffer may continue in the next read
+        if end == len(buffer) and not finished:
+            read_more()
+            continue
+        yield item
+        position, expect_item = end, False
+
+
+def parse_json_line(line):
+    '''Malformed line is returned as is to be reported as bad row'''
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line.strip()
+
+
+def parse_row(row):
+    '''Returns (name, unit) of the row or raises ValueError'''
+    if not isinstance(row, (list, tuple)) or len(row) != 2:
+        raise ValueError(EXPECTED_TWO_VALUES)
+    name, unit = (
+        str(value).strip() if value is not None else '' for value in row
+    )
+    if not name or not unit:
+        raise ValueError(EMPTY_VALUE)
+    if len(name) > NAME_LENGTH or len(unit) > UNIT_LENGTH:
+        raise ValueError(
+            VALUE_TOO_LONG.format(max(NAME_LENGTH, UNIT_LENGTH))
+        )
+    return name, unit
+
 
 class Command(BaseCommand):
     help = "Load ingredients data to Database"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_PATH,
+            help='CSV or JSON file, optionally compressed with gzip'
+        )
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--max-errors', type=int, default=20,
+            help='Number of bad rows printed in the report'
+        )
+
     def handle(self, *args, **options):
-        with open("recipes/data/ingredients.csv", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                name, unit = row
-                try:
-                    Ingredient.objects.get_or_create(
-                        name=name, measurement_unit=unit
-                    )
-                except Exception as exception:
-                    # TODO: Logging
-                    return exception
-        return _("Data was successfully loaded to the database")
+        path = options['path']
+        reader = {'csv': read_csv, 'json': read_json}[
+            options['format'] or detect_format(path)
+        ]
+        self.bad_rows = []
+        self.read = 0
+        before = Ingredient.objects.count()
+        try:
+            stream = open_text(path)
+        except FileNotFoundError:
+            raise CommandError(FILE_NOT_FOUND.format(path))
+        with stream:
+            rows = enumerate(reader(stream), start=1)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                self.load_batch(batch)
+                if options['verbosity']:
+                    self.stdout.write(PROGRESS_MESSAGE.format(self.read))
+        added = Ingredient.objects.count() - before
+        if added:
+            # bulk_create sends no signals, so the catalog version kept
+            # in the database is bumped here for every server process
+            caching.bump_version(caching.INGREDIENTS_VERSION)
+        for number, row, error in self.bad_rows[:options['max_errors']]:
+            self.stderr.write(BAD_ROW_MESSAGE.format(number, row, error))
+        return str(LOADED_MESSAGE.format(
+            self.read, added, len(self.bad_rows)
+        ))
+
+    def load_batch(self, batch):
+        '''Inserts new ingredients of the batch with one statement,
+        existing ones are skipped by the unique constraint'''
+        ingredients = {}
+        for number, row in batch:
+            try:
+                ingredients[parse_row(row)] = None
+            except ValueError as error:
+                self.bad_rows.append((number, row, error))
+        self.read += len(batch)
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=unit)
+             for name, unit in ingredients],
+            ignore_conflicts=True
+        )
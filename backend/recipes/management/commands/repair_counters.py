@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _
+
+from recipes.models import Cart, Favorite, Recipe
+from recipes.utils import count_of
+from users.models import User
+
+REPAIRED_MESSAGE = _(
+    'Repaired counters: recipes_count for {} users, '
+    'favorites_count for {} recipes, in_carts_count for {} recipes'
+)
+
+
+def repair(queryset, counter, actual):
+    '''Rewrites only rows whose stored counter drifted
+    from the actual value and returns their number'''
+    return queryset.exclude(**{counter: actual}).update(**{counter: actual})
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized recipe and author counters"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = repair(
+                User.objects.all(), 'recipes_count',
+                count_of(Recipe, 'author')
+            )
+            favorites = repair(
+                Recipe.objects.all(), 'favorites_count',
+                count_of(Favorite, 'recipe')
+            )
+            carts = repair(
+                Recipe.objects.all(), 'in_carts_count',
+                count_of(Cart, 'recipe')
+            )
+        return str(REPAIRED_MESSAGE.format(users, favorites, carts))
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils.translation import ugettext_lazy as _
+
+from api.images import IMAGE_FIELDS
+from recipes.models import Recipe
+
+SWEPT_MESSAGE = _('{} unreferenced files of {} removed')
+
+
+def walk(directory=''):
+    '''Names of all files of the storage under the directory'''
+    directories, files = default_storage.listdir(directory)
+    for name in files:
+        yield os.path.join(directory, name)
+    for name in directories:
+        yield from walk(os.path.join(directory, name))
+
+
+class Command(BaseCommand):
+    help = "Remove media files no recipe refers to"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=settings.MEDIA_RELEASE_GRACE,
+            help='Keep files modified less than this number of seconds '
+                 'ago, they may belong to a not yet committed upload'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        for field in IMAGE_FIELDS:
+            referenced.update(
+                Recipe.objects.exclude(**{field: ''}).values_list(
+                    field, flat=True
+                ).iterator()
+            )
+        threshold = time.time() - options['grace']
+        total = removed = 0
+        for name in walk():
+            total += 1
+            if name in referenced or os.path.getmtime(
+                    default_storage.path(name)) > threshold:
+                continue
+            removed += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(name)
+            if not options['dry_run']:
+                default_storage.delete(name)
+        return str(SWEPT_MESSAGE.format(removed, total))
@@ -0,0 +1,78 @@
+# Generated by Django 3.0.5 on 2026-10-18 08:20
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    '''UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector(%(config)s, coalesce(name, '')), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce(text, '')), 'B')''',
+    '''CREATE INDEX recipe_search_idx ON recipes_recipe
+        USING gin (search_vector)''',
+]
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS recipe_search_idx',
+]
+SQLITE_FORWARD = [
+    '''CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        name, text, content='recipes_recipe', content_rowid='id')''',
+    '''CREATE TRIGGER recipes_recipe_fts_insert
+        AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END''',
+    '''CREATE TRIGGER recipes_recipe_fts_delete
+        AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END''',
+    '''CREATE TRIGGER recipes_recipe_fts_update
+        AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END''',
+    '''INSERT INTO recipes_recipe_fts(recipes_recipe_fts)
+        VALUES ('rebuild')''',
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+]
+
+
+def run_for_vendor(postgres, sqlite):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        statements = {'postgresql': postgres, 'sqlite': sqlite}.get(
+            vendor, []
+        )
+        for statement in statements:
+            schema_editor.execute(
+                statement, {'config': settings.SEARCH_CONFIG}
+                if vendor == 'postgresql' else None
+            )
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_recipe_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Search vector'),
+        ),
+        migrations.RunPython(
+            run_for_vendor(POSTGRES_FORWARD, SQLITE_FORWARD),
+            run_for_vendor(POSTGRES_BACKWARD, SQLITE_BACKWARD),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:00
+
+from hashlib import sha256
+
+from django.db import migrations, models
+
+
+def make_fingerprint(*values):
+    normalized = '\n'.join(
+        ' '.join(value.split()).casefold() for value in values
+    )
+    return sha256(normalized.encode()).hexdigest()
+
+
+def populate_fingerprints(apps, schema_editor):
+    '''Recipes of one author colliding after normalization get
+    their id mixed into the hash to satisfy the new constraint'''
+    Recipe = apps.get_model('recipes', 'Recipe')
+    seen = set()
+    recipes = []
+    for recipe in Recipe.objects.order_by('id').only(
+            'id', 'author_id', 'name', 'text'):
+        recipe.fingerprint = make_fingerprint(recipe.name, recipe.text)
+        if (recipe.author_id, recipe.fingerprint) in seen:
+            recipe.fingerprint = make_fingerprint(
+                recipe.name, recipe.text, str(recipe.id))
+        seen.add((recipe.author_id, recipe.fingerprint))
+        recipes.append(recipe)
+    Recipe.objects.bulk_update(recipes, ['fingerprint'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0023_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=64, verbose_name='Content fingerprint'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_fingerprints, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='recipe',
+            constraint=models.UniqueConstraint(fields=('author', 'fingerprint'), name='unique_recipe_fingerprint'),
+        ),
+    ]
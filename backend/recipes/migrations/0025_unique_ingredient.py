@@ -0,0 +1,45 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    '''Keeps the first of equal ingredients and moves
+    portions of the others to it'''
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        others = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep'])
+        for portion in IngredientRecipe.objects.filter(ingredient__in=others):
+            kept = IngredientRecipe.objects.filter(
+                recipe_id=portion.recipe_id, ingredient_id=group['keep']
+            ).first()
+            if kept is None:
+                portion.ingredient_id = group['keep']
+                portion.save(update_fields=['ingredient'])
+            else:
+                kept.amount += portion.amount
+                kept.save(update_fields=['amount'])
+                portion.delete()
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0024_recipe_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
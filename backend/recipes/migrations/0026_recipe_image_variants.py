@@ -0,0 +1,43 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0025_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='', verbose_name='Thumbnail'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail_width',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Thumbnail width'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail_height',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Thumbnail height'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_display',
+            field=models.ImageField(blank=True, editable=False, upload_to='', verbose_name='Display image'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_display_width',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Display image width'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_display_height',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Display image height'),
+        ),
+    ]
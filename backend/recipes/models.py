@@ -1,9 +1,13 @@
+from hashlib import sha256
+
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
-from django.db import models
+from django.db import models, router
 from django.utils.translation import ugettext_lazy as _
 
+from . import search
 from .validators import SlugRegexValidator
 
 User = get_user_model()
@@ -59,6 +63,10 @@ class Ingredient(models.Model):
         ordering = ['name']
         verbose_name = _('Ingredient')
         verbose_name_plural = _('Ingredients')
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'measurement_unit'],
+                                    name='unique_ingredient'),
+        ]
 
     def __str__(self):
         return self.name
@@ -88,6 +96,58 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name=_('Image'),
         )
+    # Described by api.images when the image is uploaded
+    image_width = models.PositiveIntegerField(
+        verbose_name=_('Image width'),
+        null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        verbose_name=_('Image height'),
+        null=True,
+        editable=False,
+    )
+    image_size = models.PositiveIntegerField(
+        verbose_name=_('Image size in bytes'),
+        null=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        verbose_name=_('Blurred image placeholder'),
+        blank=True,
+        editable=False,
+    )
+    # Variants are rendered by api.images after the upload is saved
+    image_thumbnail = models.ImageField(
+        verbose_name=_('Thumbnail'),
+        blank=True,
+        editable=False,
+    )
+    image_thumbnail_width = models.PositiveIntegerField(
+        verbose_name=_('Thumbnail width'),
+        null=True,
+        editable=False,
+    )
+    image_thumbnail_height = models.PositiveIntegerField(
+        verbose_name=_('Thumbnail height'),
+        null=True,
+        editable=False,
+    )
+    image_display = models.ImageField(
+        verbose_name=_('Display image'),
+        blank=True,
+        editable=False,
+    )
+    image_display_width = models.PositiveIntegerField(
+        verbose_name=_('Display image width'),
+        null=True,
+        editable=False,
+    )
+    image_display_height = models.PositiveIntegerField(
+        verbose_name=_('Display image height'),
+        null=True,
+        editable=False,
+    )
     name = models.CharField(
         max_length=200,
         verbose_name=_('Recipe name'),
@@ -104,15 +164,84 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name=_('Publication date')
     )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('Modification date')
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name=_('Favorites count'),
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name=_('Shopping carts count'),
+        default=0,
+        editable=False,
+    )
+    version = models.PositiveIntegerField(
+        verbose_name=_('Version'),
+        default=1,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name=_('Search vector'),
+        null=True,
+        editable=False,
+    )
+    fingerprint = models.CharField(
+        max_length=64,
+        verbose_name=_('Content fingerprint'),
+        editable=False,
+    )
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='recipe_feed_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'fingerprint'],
+                                    name='unique_recipe_fingerprint'),
+        ]
         verbose_name = _('Recipe')
         verbose_name_plural = _('Recipes')
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def make_fingerprint(name, text):
+        '''Hash of case-folded name and description with collapsed
+        whitespace, unique per author'''
+        normalized = '\n'.join(
+            ' '.join(value.split()).casefold() for value in (name, text)
+        )
+        return sha256(normalized.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        '''Bumps version of an edited recipe so that payloads cached
+        for the previous version are not used and keeps search vector
+        and content fingerprint up to date'''
+        self.fingerprint = self.make_fingerprint(self.name, self.text)
+        update_fields = kwargs.get('update_fields')
+        if self.pk is not None:
+            self.version += 1
+            if update_fields is not None:
+                update_fields = set(update_fields) | {
+                    'version', 'fingerprint'}
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self)
+        if search.uses_search_vector(using) and (
+            update_fields is None or {'name', 'text'} & set(update_fields)
+        ):
+            self.search_vector = search.instance_search_vector(self)
+            if update_fields is not None:
+                update_fields = set(update_fields) | {'search_vector'}
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        self.search_vector = None
+
 
 class IngredientRecipe(models.Model):
     '''Model for creating certain amounts (portions) of ingredients'''
@@ -222,3 +351,24 @@ class Favorite(models.Model):
 
     def __str__(self):
         return FAVORITES_STRING_METHOD.format(self.user.username)
+
+
+class DataVersion(models.Model):
+    '''Time of the last change of a named data set. Kept in the
+    database, so changes made by any server process or management
+    command are seen by all of them'''
+    name = models.CharField(
+        max_length=64,
+        primary_key=True,
+        verbose_name=_('Data set'),
+    )
+    changed = models.FloatField(
+        verbose_name=_('Change time'),
+    )
+
+    class Meta:
+        verbose_name = _('Data version')
+        verbose_name_plural = _('Data versions')
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connections
+from django.db.models import FloatField, Q, TextField, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_MATCH_SQL = (
+    'SELECT rowid FROM recipes_recipe_fts WHERE recipes_recipe_fts MATCH %s'
+)
+FTS_RANK_SQL = (
+    'SELECT -bm25(recipes_recipe_fts, 4.0, 1.0) FROM recipes_recipe_fts '
+    'WHERE recipes_recipe_fts MATCH %s '
+    'AND recipes_recipe_fts.rowid = recipes_recipe.id'
+)
+FTS_TRIGGERS = {
+    'recipes_recipe_fts_insert': '''CREATE TRIGGER IF NOT EXISTS
+        recipes_recipe_fts_insert AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END''',
+    'recipes_recipe_fts_delete': '''CREATE TRIGGER IF NOT EXISTS
+        recipes_recipe_fts_delete AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END''',
+    'recipes_recipe_fts_update': '''CREATE TRIGGER IF NOT EXISTS
+        recipes_recipe_fts_update AFTER UPDATE OF name, text
+        ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END''',
+}
+FTS_REBUILD_SQL = (
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild')"
+)
+SQLITE_OBJECTS_SQL = (
+    'SELECT name FROM sqlite_master WHERE type = %s AND name IN ({})'
+)
+
+
+def build_search_vector(name, text):
+    '''Weighted tsvector expression, name ranks above description.
+    Arguments are field names or Value expressions.'''
+    config = settings.SEARCH_CONFIG
+    return (
+        SearchVector(name, weight='A', config=config)
+        + SearchVector(text, weight='B', config=config)
+    )
+
+
+def instance_search_vector(recipe):
+    '''Search vector expression built from values of the instance,
+    so it can be written by both INSERT and UPDATE'''
+    return build_search_vector(
+        Value(recipe.name, output_field=TextField()),
+        Value(recipe.text, output_field=TextField()),
+    )
+
+
+def uses_search_vector(using):
+    return connections[using].vendor == 'postgresql'
+
+
+def refresh_search_vectors(queryset):
+    '''Recomputes vectors of rows written bypassing Recipe.save,
+    the SQLite index is maintained by triggers'''
+    if uses_search_vector(queryset.db):
+        queryset.update(search_vector=build_search_vector('name', 'text'))
+
+
+def ensure_fts_triggers(using):
+    '''SQLite rebuilds recipes_recipe whenever a migration alters it,
+    which drops the triggers maintaining the full-text index. Missing
+    triggers are recreated after every migrate and the index is
+    rebuilt, rows may have changed while they were missing.'''
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(SQLITE_OBJECTS_SQL.format('%s'), ['table', FTS_TABLE])
+        if cursor.fetchone() is None:
+            # Migrated back before the full-text index was added
+            return
+        cursor.execute(
+            SQLITE_OBJECTS_SQL.format(', '.join(['%s'] * len(FTS_TRIGGERS))),
+            ['trigger', *FTS_TRIGGERS]
+        )
+        existing = {name for name, in cursor.fetchall()}
+        if existing == set(FTS_TRIGGERS):
+            return
+        for name, statement in FTS_TRIGGERS.items():
+            if name not in existing:
+                cursor.execute(statement)
+        cursor.execute(FTS_REBUILD_SQL)
+
+
+def to_fts5_query(value):
+    '''Quotes every word, so user input is never parsed
+    as FTS5 query syntax and all words are required'''
+    return ' '.join(
+        '"{}"'.format(word.replace('"', '""')) for word in value.split()
+    )
+
+
+def search_recipes(queryset, value):
+    '''Filters recipes by words of name and description and orders
+    them by relevance: tsvector with GIN index on PostgreSQL, FTS5
+    table on SQLite, plain icontains elsewhere'''
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        query = SearchQuery(value, config=settings.SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank('search_vector', query)
+        ).order_by('-search_rank', '-pub_date', '-id')
+    if vendor == 'sqlite':
+        query = to_fts5_query(value)
+        if not query:
+            return queryset
+        return queryset.filter(
+            id__in=RawSQL(FTS_MATCH_SQL, [query])
+        ).annotate(
+            search_rank=RawSQL(FTS_RANK_SQL, [query], FloatField())
+        ).order_by('-search_rank', '-pub_date', '-id')
+    return queryset.filter(Q(name__icontains=value) | Q(text__icontains=value))
@@ -0,0 +1,46 @@
+import os
+from hashlib import sha256
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''Stores files under the hash of their content, so identical
+    uploads share one file which is written only once. Files are
+    removed by api.images.release_files when no recipe refers to
+    them any more and were not saved within MEDIA_RELEASE_GRACE
+    seconds, younger files are left to the sweep_media command.'''
+
+    def get_content_name(self, name, content):
+        '''Name of the content: directory and extension of name
+        with the sha256 of the content as file name'''
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        return os.path.join(
+            directory, digest[:2],
+            digest + os.path.splitext(filename)[1].lower()
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if not self.exists(name):
+            name = super().save(name, content, max_length=max_length)
+        else:
+            # A reused file is as fresh as a written one, so releases
+            # and sweeps within the grace period keep it for the not
+            # yet committed recipe referring to it
+            os.utime(self.path(name))
+        if hasattr(content, 'temporary_file_path'):
+            # The temporary file is either moved into the storage or
+            # not needed, closing it now frees the disk space and
+            # keeps it from removing a moved file
+            content.close()
+        return name
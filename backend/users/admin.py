@@ -12,6 +12,7 @@ class MyUserAdmin(admin.ModelAdmin):
         "email",
         "role",
         "is_active",
+        "recipes_count",
         "id"
     )
     list_filter = (
@@ -56,6 +56,11 @@ class User(AbstractUser):
         default=True,
         help_text=(HELP_TEXT_FOR_USER_ACTIVE_FIELD),
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name=_("Recipes count"),
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('username', )